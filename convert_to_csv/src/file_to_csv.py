@@ -1,12 +1,21 @@
 import struct
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 import logging
+import math
 import sys
 import json
+import collections
 import csv
+import errno
+import io
 import pyreadstat
 import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, wait
 from botocore.exceptions import ClientError
 from pyreadstat._readstat_parser import ReadstatError
 
@@ -16,9 +25,50 @@ logger = logging.getLogger(__name__)
 logging.basicConfig(format='%(asctime)s %(module)s %(levelname)s: %(message)s',
                     datefmt='%m/%d/%Y %I:%M:%S %p', level=logging.INFO)
 
+# Keep pyreadstat on its cheapest read path: value labels are written out separately from the metadata rather than
+# applied to every cell, and user-defined missing values are read as plain missing values
+spss_read_options = {"apply_value_formats": False, "user_missing": False, "dates_as_pandas_datetime": False}
 
-def get_ledger(ledger_s3, bucket_name):
-    s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
+# Below this size the cost of starting the worker processes outweighs parsing an SPSS file in parallel
+spss_multiprocessing_min_size = 50 * 1024 * 1024
+
+
+def available_cpus():
+    # The CPUs this process may use. A Kubernetes CPU limit is enforced as a CFS quota, which sched_getaffinity doesn't
+    # see (it still reports every CPU on the node), so the quota is read from the cgroup, v2 then v1, to cap the count.
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as cpu_max:
+            quota, period = cpu_max.read().split()
+    except (OSError, ValueError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as cfs_quota, \
+                    open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as cfs_period:
+                quota, period = cfs_quota.read().strip(), cfs_period.read().strip()
+        except OSError:
+            return cpus
+    # "max" (v2) or -1 (v1) mean there is no limit
+    if quota in ("max", "-1"):
+        return cpus
+    return max(1, min(cpus, math.ceil(int(quota) / int(period))))
+
+
+# Parse large SPSS files on the CPUs the pod is actually allowed to use, capped at 8 as every worker holds its own slice
+# of the data until the slices are concatenated
+spss_processes = min(available_cpus(), 8)
+
+# Download the target files to RAM-backed /dev/shm where the pod has it, falling back to the default temp dir on disk
+scratch_dirs = ["/dev/shm", None] if os.path.isdir("/dev/shm") else [None]
+
+# The converted csv files are uploaded in 8MB parts (S3 needs every part but the last to be at least 5MB)
+multipart_part_size = 8 * 1024 * 1024
+# Parts of one csv uploading at once, while the next part is encoded
+multipart_parts_in_flight = 2
+
+
+def get_ledger(ledger_s3, bucket_name, s3_client=None):
+    if s3_client is None:
+        s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
     ledger_obj = s3_client.get_object(Bucket=bucket_name, Key=ledger_s3)
     ledger = json.loads(ledger_obj["Body"].read())
     target_file_location = ledger["location_details"]
@@ -27,74 +77,126 @@ def get_ledger(ledger_s3, bucket_name):
     return ledger, target_file_location
 
 
-def get_target_file(target_file_path):
+def download_to_scratch(s3_client, bucket_name, key):
+    # pyreadstat and pandas can't handle streaming data, so the file is downloaded to a uniquely named scratch file and
+    # parsed from there. The converters delete the scratch file once they have parsed it.
+    suffix = os.path.splitext(key)[1]
+    for scratch_dir in scratch_dirs:
+        with tempfile.NamedTemporaryFile(suffix=suffix, dir=scratch_dir, delete=False) as scratch_file:
+            local_file = scratch_file.name
+        try:
+            return s3_connector.parallel_download(s3_client, bucket_name, key, local_file)
+        except Exception as e:
+            os.remove(local_file)
+            out_of_space = isinstance(e, OSError) and e.errno == errno.ENOSPC
+            if not out_of_space or scratch_dir is None:
+                raise e
+            logger.warning("Not enough space in {0} for the target file, downloading it to disk instead"
+                           .format(scratch_dir))
+
+
+def bucket_missing(s3_client, bucket_name):
+    # A HEAD gets a bare 404 whether the bucket or the key is missing, so ask about the bucket on its own to tell them
+    # apart
+    try:
+        s3_client.head_bucket(Bucket=bucket_name)
+    except ClientError as e:
+        return e.response["Error"]["Code"] in ["404", "NoSuchBucket"]
+    return False
+
+
+def get_target_file(target_file_path, s3_client=None):
     target_file_loc_type = target_file_path.split("/")[0]
     logger.info("Location type where the target file is kept : {0}".format(target_file_loc_type))
     if target_file_loc_type == "s3a:":
-        s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
+        if s3_client is None:
+            s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
         # derive bucket for the file to be converted from the full path given
         target_file_bucket = target_file_path.split("/")[2]
         target_file_route = "/".join(target_file_path.split("/")[3:])
         logger.info("The target file will be loaded from bucket {0} at path {1}".format(target_file_bucket,
                                                                                         target_file_route))
         try:
-            target_file = s3_client.get_object(Bucket=target_file_bucket, Key=target_file_route)["Body"]
+            target_file = download_to_scratch(s3_client, target_file_bucket, target_file_route)
             logger.info("TARGET FILE LOADED SUCCESSFULLY")
         except ClientError as e:
-            if e.response['Error']['Code'] == 'NoSuchKey':
-                logger.critical("The file at path {0} does not exist! DAG failing.".format(target_file_path))
-            if e.response["Error"]["Code"] == "NoSuchBucket":
+            error_code = e.response["Error"]["Code"]
+            if error_code == "NoSuchBucket" or (error_code == "404" and bucket_missing(s3_client, target_file_bucket)):
                 logger.critical("The bucket {0} does not exist! DAG failing.".format(target_file_bucket))
+            elif error_code in ['404', 'NoSuchKey']:
+                logger.critical("The file at path {0} does not exist! DAG failing.".format(target_file_path))
             raise e
     else:
         raise ValueError("This can currently only get files from S3")
     return target_file
 
 
+def flatten_value_labels(value_labels):
+    # Flattens {field: {code: meaning}} value labels into a frame with one (Field, Code, Meaning) row per code. The
+    # columns are pre-sized and filled a field at a time, instead of allocating a new list for every row.
+    n_rows = sum(len(codes) for codes in value_labels.values())
+    fields = np.empty(n_rows, dtype=object)
+    codes = np.empty(n_rows, dtype=object)
+    meanings = np.empty(n_rows, dtype=object)
+
+    start = 0
+    for field, field_codes in value_labels.items():
+        end = start + len(field_codes)
+        fields[start:end] = field
+        codes[start:end] = list(field_codes.keys())
+        meanings[start:end] = list(field_codes.values())
+        start = end
+
+    # the columns were filled as objects, so give them back the types pandas infers for the same rows, e.g. int64 codes
+    return pd.DataFrame({"Field": fields, "Code": codes, "Meaning": meanings}, copy=False).infer_objects()
+
+
+def to_arrow(df):
+    # The converted data is only ever written out as csv, so it is kept as an Arrow table where possible. Arrow can't
+    # type columns that mix values, e.g. the category pandas makes of a partially labelled Stata column, which holds
+    # label strings alongside raw codes, so those frames stay in pandas and are written by its csv writer instead.
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return df
+
+
 def convert_spss(local_target_file, target_file_path):
-    # We have to save the file to disk temporarily because pyreadstat can't handle streaming data
-    temp_filename = "tmp-spss.sav"
-    with open(temp_filename, 'wb') as f:
-        f.write(local_target_file.read())
     try:
-        df, meta = pyreadstat.read_sav("tmp-spss.sav")
+        if spss_processes > 1 and os.path.getsize(local_target_file) >= spss_multiprocessing_min_size:
+            df, meta = pyreadstat.read_file_multiprocessing(pyreadstat.read_sav, local_target_file,
+                                                            num_processes=spss_processes, **spss_read_options)
+        else:
+            df, meta = pyreadstat.read_sav(local_target_file, **spss_read_options)
     except ReadstatError as error:
         logger.critical("PyReadStat couldn't parse the file. It is either corrupted or empty. The file it tried to read"
                         "is {0}".format(target_file_path))
         raise error
+    finally:
+        # now we delete the temp file
+        os.remove(local_target_file)
 
-    values_list = []
-    for key1, value1 in meta.variable_value_labels.items():
-        for key2, value2 in value1.items():
-            values_list.append([key1, key2, value2])
-
-    val_df = pd.DataFrame(data=values_list, columns=["Field", "Code", "Meaning"])
+    # files without value labels get no values frame at all, so no empty csv is uploaded for them
+    val_df = flatten_value_labels(meta.variable_value_labels) if meta.variable_value_labels else None
 
-    desc_list = []
-    for k1, v1 in meta.column_names_to_labels.items():
-        desc_list.append([k1, v1])
+    desc_df = pd.DataFrame.from_records(list(meta.column_names_to_labels.items()), columns=["Field", "Meaning"])
 
-    desc_df = pd.DataFrame(data=desc_list, columns=["Field", "Meaning"])
+    table = to_arrow(df)
+    del df
 
     logger.info("SPSS file {0} has been converted to CSV".format(target_file_path))
 
-    # now we delete the temp file
-    os.remove(temp_filename)
-    return df, {"-values": val_df, "-description": desc_df}
+    return table, {"-values": val_df, "-description": desc_df}
 
 
 def convert_stata(local_target_file, target_file_path):
-    # We have to save the file to disk temporarily because we can't use .read() twice on StreamingBddy objects
-    temp_filename = "tmp-stata.dta"
-    with open(temp_filename, 'wb') as f:
-        f.write(local_target_file.read())
     logger.info("Converting the file from Stata to csv")
 
     try:
-        df = pd.read_stata(temp_filename)
-        sr = pd.io.stata.StataReader(temp_filename)
-        vl = sr.value_labels()
-        sr.close()
+        # read the data and the value labels from the same reader so the file is only opened and parsed once
+        with pd.io.stata.StataReader(local_target_file) as sr:
+            df = sr.read()
+            vl = sr.value_labels()
     except struct.error as err:
         logger.critical("The stata file at location {0} is either empty or corrupted. DAG failing."
                         .format(target_file_path))
@@ -103,106 +205,249 @@ def convert_stata(local_target_file, target_file_path):
         logger.critical("Either the version of the given Stata file is not supported by pandas, or it's not a Stata "
                         "file at all. File given: {0}. DAG failing.".format(target_file_path))
         raise err
+    finally:
+        # now we delete the temp file
+        os.remove(local_target_file)
 
-    values_list = []
-    for key1, value1 in vl.items():
-        for key2, value2 in value1.items():
-            values_list.append([key1, key2, value2])
+    # unlabelled files have nothing to flatten, and no values csv is uploaded for them
+    val_df = flatten_value_labels(vl) if vl else None
+    table = to_arrow(df)
+    del df
 
-    val_df = pd.DataFrame(data=values_list, columns=["Field", "Code", "Meaning"])
     logger.info("STATA file {0} has been converted to CSV".format(target_file_path))
+    return table, {"-values": val_df}
+
+
+def trim_timestamps(table):
+    # Arrow writes timestamps and times at their full stored precision, where pandas wrote each column at the coarsest
+    # precision that held all its values. Cast each one down to that precision: dates only for timestamps that are all
+    # at midnight, then whole seconds, milliseconds or microseconds (safe casts raise ArrowInvalid rather than drop any
+    # sub-second part), and whole seconds for times.
+    for i, field in enumerate(table.schema):
+        column = table.column(i)
+        if pa.types.is_timestamp(field.type):
+            units = [pa.timestamp(unit, field.type.tz) for unit in ("s", "ms", "us")]
+            # the cast to a date truncates silently, so check that it round trips before using it
+            if field.type.tz is None:
+                dates = column.cast(pa.date32())
+                if pc.all(pc.equal(dates.cast(field.type), column)).as_py() is not False:
+                    units = [pa.date32()]
+        elif pa.types.is_time64(field.type):
+            units = [pa.time32("s")]
+        else:
+            continue
+        for unit in units:
+            try:
+                table = table.set_column(i, field.name, column.cast(unit))
+                break
+            except pa.ArrowInvalid:
+                pass
+    return table
+
+
+def is_text(data_type):
+    return pa.types.is_string(data_type) or pa.types.is_large_string(data_type) or (
+        pa.types.is_dictionary(data_type) and is_text(data_type.value_type))
+
+
+def is_numeric(data_type):
+    return pa.types.is_integer(data_type) or pa.types.is_floating(data_type) or pa.types.is_boolean(data_type)
+
+
+def pandas_text(column):
+    # The text pandas' csv writer gives each value, missing values left null. Arrow's own cast writes whole floats
+    # without their ".0" and switches to exponents at different magnitudes, which changes the type Spark infers for the
+    # column, so floats go through numpy's repr as pandas does. Booleans are written as True and False.
+    if pa.types.is_floating(column.type):
+        return pa.chunked_array([pa.array(chunk.to_numpy(zero_copy_only=False).astype(str), type=pa.string(),
+                                          mask=chunk.is_null().to_numpy(zero_copy_only=False))
+                                 for chunk in column.chunks], type=pa.string())
+    if pa.types.is_boolean(column.type):
+        return pc.if_else(column, "True", "False")
+    return column.cast(pa.string())
+
+
+def join_csv_lines(columns):
+    # Joins the text columns of a block into comma separated lines, and reads the bytes of the whole block straight
+    # from the Arrow buffer that holds them
+    lines = pc.binary_join_element_wise(*columns, ",")
+    lines = pc.binary_join_element_wise(lines, "", "\n").combine_chunks()
+    offsets = np.frombuffer(lines.buffers()[1], dtype=np.int32)[lines.offset:lines.offset + len(lines) + 1]
+    return lines.buffers()[2][offsets[0]:offsets[-1]].to_pybytes()
+
+
+def csv_block(table, minimal_quoting):
+    # Arrow's writer has no minimal quoting style ("needed" quotes every string and "none" refuses any value that needs
+    # quotes) and formats floats differently from pandas. So the block is built with compute kernels instead, a column
+    # at a time, from the text pandas gives each value. With minimal_quoting only the strings holding a delimiter,
+    # quote or line break are quoted. Otherwise, as pandas does, everything but numbers is quoted, missing values too.
+    if table.num_rows == 0:
+        return b""
+    columns = []
+    for column in table.columns:
+        text = pandas_text(column)
+        if minimal_quoting:
+            if is_text(column.type):
+                quoted = pc.binary_join_element_wise('"', pc.replace_substring(text, '"', '""'), '"', "")
+                text = pc.if_else(pc.match_substring_regex(text, '[,"\r\n]'), quoted, text)
+            text = pc.fill_null(text, "")
+        elif is_numeric(column.type):
+            text = pc.fill_null(text, '""')
+        else:
+            text = pc.binary_join_element_wise('"', pc.replace_substring(pc.fill_null(text, ""), '"', '""'), '"', "")
+        columns.append(text)
+    return join_csv_lines(columns)
+
+
+def csv_chunks(frame, minimal_quoting=False, rows_per_chunk=8192):
+    # Yields the csv encoding of an Arrow table or a pandas DataFrame one block of rows at a time, header first, so the
+    # whole csv never has to be held in memory at once. An empty frame still yields its header.
+    # By default strings are quoted and numbers aren't (like csv.QUOTE_NONNUMERIC). With minimal_quoting, values are
+    # only quoted when they contain a delimiter, quote or line break (like csv.QUOTE_MINIMAL).
+    quoting = csv.QUOTE_MINIMAL if minimal_quoting else csv.QUOTE_NONNUMERIC
+    if isinstance(frame, pd.DataFrame):
+        frame = to_arrow(frame)
+        if isinstance(frame, pd.DataFrame):
+            for start in range(0, max(len(frame), 1), rows_per_chunk):
+                yield frame.iloc[start:start + rows_per_chunk].to_csv(index=False, header=start == 0,
+                                                                      quoting=quoting).encode()
+            return
+
+    table = trim_timestamps(frame)
+    header = io.StringIO()
+    csv.writer(header, lineterminator="\n", quoting=quoting).writerow(table.column_names)
+    yield header.getvalue().encode()
+
+    for start in range(0, table.num_rows, rows_per_chunk):
+        yield csv_block(table.slice(start, rows_per_chunk), minimal_quoting)
+
+
+def upload_csv(frame, s3_client, bucket_name, csv_path, minimal_quoting=False):
+    # The csv is encoded a block of rows at a time and each 8MB part is handed to a background upload as soon as it
+    # fills up, so the next part is encoded while the last one is sent. At most multipart_parts_in_flight parts are
+    # uploading at once, so memory stays bounded by a few parts rather than the size of the whole file.
+    part_buffer = io.BytesIO()
+    upload_id = None
+    parts = []
+    pending = collections.deque()
+
+    def upload_part(part_number, body):
+        part = s3_client.upload_part(Bucket=bucket_name, Key=csv_path, UploadId=upload_id, PartNumber=part_number,
+                                     Body=body)
+        return {"PartNumber": part_number, "ETag": part["ETag"]}
+
+    with ThreadPoolExecutor(max_workers=multipart_parts_in_flight) as executor:
+        def submit_part():
+            # wait for the oldest part to finish before starting another once the limit is reached
+            if len(pending) >= multipart_parts_in_flight:
+                parts.append(pending.popleft().result())
+            pending.append(executor.submit(upload_part, len(parts) + len(pending) + 1, part_buffer.getvalue()))
+            part_buffer.seek(0)
+            part_buffer.truncate()
 
-    # now we delete the temp file
-    os.remove(temp_filename)
-    return df, {"-values": val_df}
-
-
-def put_converted_file_s3(converted_df, extra_dfs, bucket_name, project_code, dag_run_id, target_file_path):
+        try:
+            for chunk in csv_chunks(frame, minimal_quoting):
+                part_buffer.write(chunk)
+                if part_buffer.tell() >= multipart_part_size:
+                    if upload_id is None:
+                        upload_id = s3_client.create_multipart_upload(Bucket=bucket_name, Key=csv_path)["UploadId"]
+                    submit_part()
+
+            if upload_id is None:
+                # the whole csv fitted in a single part, so one PUT is enough
+                s3_client.put_object(Bucket=bucket_name, Key=csv_path, Body=part_buffer.getvalue())
+            else:
+                if part_buffer.tell():
+                    submit_part()
+                parts.extend(future.result() for future in pending)
+                s3_client.complete_multipart_upload(Bucket=bucket_name, Key=csv_path, UploadId=upload_id,
+                                                    MultipartUpload={"Parts": parts})
+        except Exception as err:
+            # don't leave the parts of an unfinished upload behind in the bucket, once any still uploading are done
+            if upload_id is not None:
+                for future in pending:
+                    future.cancel()
+                wait(pending)
+                s3_client.abort_multipart_upload(Bucket=bucket_name, Key=csv_path, UploadId=upload_id)
+            raise err
+
+
+def put_converted_file_s3(converted_table, extra_dfs, bucket_name, project_code, dag_run_id, target_file_path,
+                          s3_client=None):
     converted_csv_name = target_file_path.split("/")[-1].split(".")[0]
     head_target_path = "/".join(target_file_path.split("/")[0:-1])
     converted_csv_path = "{0}/{1}.csv".format(head_target_path, converted_csv_name)
 
-    s3_conn = s3_connector.get_conn_details()
-    s3_client = s3_connector.make_s3_client(s3_conn)
-    # check that the bucket we're writing to still exists
-    try:
-        s3_client.head_bucket(Bucket=bucket_name)
-    except ClientError as err:
-        if err.response["Error"]["Code"] == "404":
-            logger.critical("The bucket {0} does not exist! DAG failing.".format(bucket_name))
-        raise err
+    if s3_client is None:
+        s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
 
     logger.info("The converted file will be saved in bucket {0} at path {1}".format(bucket_name, converted_csv_path))
 
-    converted_df.to_csv(
-        f"s3://{bucket_name}/{converted_csv_path}",
-        index=False,
-        storage_options={
-            "key": s3_conn["access_key"],
-            "secret": s3_conn["access_secret"],
-            "client_kwargs": {
-                "endpoint_url": s3_conn["endpoint"]
-            }
-        },
-    )
-
-    logger.info("The converted file has been saved in bucket {0} at path {1}".format(bucket_name, converted_csv_path))
-
+    # the main csv is quoted minimally, the extra files quote every string
+    uploads = [("converted", converted_table, converted_csv_path, True)]
     for name, extra_df in extra_dfs.items():
+        # the converters return None in place of extra files that would be empty
+        if extra_df is None:
+            continue
         extra_df_path = "{0}/jobs/{1}/converted_files/{2}{3}.csv".format(project_code, dag_run_id, converted_csv_name,
                                                                          name)
-        extra_df.to_csv(
-            f"s3://{bucket_name}/{extra_df_path}",
-            index=False,
-            header=True,
-            quoting=csv.QUOTE_NONNUMERIC,
-            storage_options={
-                "key": s3_conn["access_key"],
-                "secret": s3_conn["access_secret"],
-                "client_kwargs": {
-                    'endpoint_url': s3_conn['endpoint']
-                }
-            },
-        )
-
-        logger.info("The extra file has been saved in bucket {0} at path {1}".format(bucket_name, extra_df_path))
+        uploads.append(("extra", extra_df, extra_df_path, False))
+
+    # The extra files are small, so they are uploaded alongside the main csv instead of each waiting for it to finish.
+    # boto3 clients are thread safe, so all the uploads share the one client.
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [(kind, path, executor.submit(upload_csv, frame, s3_client, bucket_name, path, minimal_quoting))
+                   for kind, frame, path, minimal_quoting in uploads]
+        for kind, path, future in futures:
+            # there's no separate check that the bucket exists, the uploads fail with NoSuchBucket if it doesn't
+            try:
+                future.result()
+            except ClientError as err:
+                if err.response["Error"]["Code"] == "NoSuchBucket":
+                    logger.critical("The bucket {0} does not exist! DAG failing.".format(bucket_name))
+                raise err
+            logger.info("The {0} file has been saved in bucket {1} at path {2}".format(kind, bucket_name, path))
 
     return converted_csv_path
 
 
-def check_converted_file(bucket_name, converted_file_path):
-    s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
+def check_converted_file(bucket_name, converted_file_path, s3_client=None):
+    if s3_client is None:
+        s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
+    # a HEAD is enough to confirm the file exists without downloading it again
     try:
-        s3_client.get_object(Bucket=bucket_name, Key=converted_file_path)["Body"].read()
+        s3_client.head_object(Bucket=bucket_name, Key=converted_file_path)
     except ClientError as e:
-        if e.response['Error']['Code'] == 'NoSuchKey':
+        error_code = e.response["Error"]["Code"]
+        if error_code == "NoSuchBucket" or (error_code == "404" and bucket_missing(s3_client, bucket_name)):
+            logger.critical("The bucket {0} does not exist! DAG failing.".format(bucket_name))
+        elif error_code in ['404', 'NoSuchKey']:
             logger.critical("The csv file in bucket {0} at path {1} does not seem to exist. This DAG FAILED!"
                             .format(bucket_name, converted_file_path))
-        if e.response["Error"]["Code"] == "NoSuchBucket":
-            logger.critical("The bucket {0} does not exist! DAG failing.".format(bucket_name))
         raise e
     return True
 
 
 def main(bucket_name, project_code, ledger_s3, dag_run_id):
-    task_ledger, target_file_loc = get_ledger(ledger_s3, bucket_name)
+    # one client is shared by every step of the conversion
+    s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
+    task_ledger, target_file_loc = get_ledger(ledger_s3, bucket_name, s3_client)
     targ_file_type = task_ledger["attributes"]["file_type"].lower()
     if targ_file_type not in ["spss", "stata"]:
         raise ValueError("The target file type in the ledger is not 'spss' or 'stata' -- are you this is correct?")
 
-    loaded_target_file = get_target_file(target_file_loc)
+    loaded_target_file = get_target_file(target_file_loc, s3_client)
 
     if targ_file_type == "spss":
-        file_as_df, other_dfs = convert_spss(loaded_target_file, target_file_loc)
+        file_as_table, other_dfs = convert_spss(loaded_target_file, target_file_loc)
     elif targ_file_type == "stata":
-        file_as_df, other_dfs = convert_stata(loaded_target_file, target_file_loc)
+        file_as_table, other_dfs = convert_stata(loaded_target_file, target_file_loc)
     else:
         raise ValueError("The target file type in the ledger is not 'spss' or 'stata' -- are you this is correct?")
 
-    converted_file_loc = put_converted_file_s3(file_as_df, other_dfs, bucket_name, project_code, dag_run_id,
-                                               target_file_loc)
-    result = check_converted_file(bucket_name, converted_file_loc)
-    return result
+    # put_converted_file_s3 raises if any upload fails, so there's no need to check the converted file exists after
+    put_converted_file_s3(file_as_table, other_dfs, bucket_name, project_code, dag_run_id, target_file_loc, s3_client)
+    return True
 
 
 if __name__ == "__main__":
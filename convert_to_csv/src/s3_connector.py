@@ -11,23 +11,32 @@ This file can be imported as a module and contains the following functions:
         retrieved by get_conn_details if no connection credentials are passed as an argument.
     * put_item - places a dict object to given path and bucket on S3 as a serialized JSON file. Creates the bucket if it
         doesn't already exist.
+    * parallel_download - downloads an object from S3 to a local file using concurrent byte-range GETs.
 
 
 """
-import json
+import functools
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
+import orjson
 from botocore.client import Config, BaseClient
 from botocore.exceptions import ParamValidationError, ClientError
 
+# Shared by every client: a connection pool large enough for all of parallel_download's threads, kept alive between
+# requests, with adaptive retries so bursts of parallel requests back off rather than fail
+client_config = Config(signature_version='s3v4', max_pool_connections=64, tcp_keepalive=True, connect_timeout=5,
+                       read_timeout=60, retries={'max_attempts': 10, 'mode': 'adaptive'})
 
+
+@functools.lru_cache(maxsize=1)
 def get_conn_details() -> dict:
     """Gets S3 connection info from Kubernetes secret "s3-secret".
 
     This gets the s3 connection configuration info from the Kubernetes secret "s3-secret". The secret is mounted to the
     pod as file system objects and is read from there. Each object is transformed to a dictionary string for ease of
-    reuse.
+    reuse. The secret doesn't change for the life of the pod, so it is only read once and the result is cached.
 
     :return: The credential information for the S3 connection that is needed to use Boto3 to connect.
     :rtype: dict
@@ -40,12 +49,13 @@ def get_conn_details() -> dict:
     return s3_conn
 
 
-def make_s3_client(s3_conn=get_conn_details()) -> BaseClient:
+def make_s3_client(s3_conn=None) -> BaseClient:
     """Makes an S3 client object that can be used to interact with the S3 storage.
 
     This makes a boto3 client object that is configured to talk to the defined S3 storage. The parameter of s3_conn is
-    OPTIONAL, and if nothing is passed it defaults to the values contained in the Airflow connection with connection id
-    "s3_conn".
+    OPTIONAL, and if nothing is passed it defaults to the values returned by get_conn_details(). Clients are cached per
+    set of connection details, so repeated calls reuse the same client and its connection pool instead of building a new
+    boto3 session each time.
 
     :param s3_conn: A dict of strings with the keys [access_key, access_secret, endpoint], defaults to the values
         contained in the Kubernetes secret with the name "s3-secret".
@@ -53,10 +63,16 @@ def make_s3_client(s3_conn=get_conn_details()) -> BaseClient:
     :return: The configured Boto3 client object that is ready to connect to the given S3 service.
     :rtype: BaseClient
     """
+    if s3_conn is None:
+        s3_conn = get_conn_details()
+    return _cached_s3_client(s3_conn["endpoint"], s3_conn["access_key"], s3_conn["access_secret"])
+
+
+@functools.lru_cache(maxsize=4)
+def _cached_s3_client(endpoint, access_key, access_secret) -> BaseClient:
     try:
-        s3_client = boto3.client('s3', aws_access_key_id=s3_conn["access_key"],
-                                 aws_secret_access_key=s3_conn["access_secret"], endpoint_url=s3_conn["endpoint"],
-                                 config=Config(signature_version='s3v4'))
+        s3_client = boto3.client('s3', aws_access_key_id=access_key, aws_secret_access_key=access_secret,
+                                 endpoint_url=endpoint, config=client_config)
     except ValueError as e:
         raise ValueError(e)
 
@@ -67,7 +83,7 @@ def put_item(object_to_put, bucket_name, target_path, s3_client) -> bool:
     """Writes a given dict object to S3 in json format.
 
     This method writes a given Python dictionary to JSON format and places it in the defined S3 bucket at the chosen
-    S3 path.
+    S3 path. The dictionary is serialised straight to UTF-8 bytes with orjson, so no intermediate str is built.
 
     :param object_to_put: The object to put in S3, encoded as a dictionary
     :type object_to_put: dict
@@ -88,7 +104,7 @@ def put_item(object_to_put, bucket_name, target_path, s3_client) -> bool:
             raise ClientError(e)
     try:
         s3_client.put_object(
-            Body=json.dumps(object_to_put),
+            Body=orjson.dumps(object_to_put),
             Bucket=bucket_name,
             Key=target_path
         )
@@ -97,3 +113,61 @@ def put_item(object_to_put, bucket_name, target_path, s3_client) -> bool:
         raise ParamValidationError()
     except ClientError as e:
         raise ClientError(e)
+
+
+def parallel_download(s3_client, bucket_name, key, dest_path, part_size=8 * 1024 * 1024, concurrency=16,
+                      read_size=1024 * 1024) -> str:
+    """Downloads an object from S3 to a local file using concurrent byte-range GETs.
+
+    This gets the size of the object with a HEAD request, splits it into byte ranges of part_size, and fetches the
+    ranges in parallel on a thread pool. Each part is streamed in read_size chunks straight to its offset in a pre-sized
+    local file, so the per-GET latency of S3 is hidden behind the parallelism and only one chunk per thread is ever held
+    in memory.
+
+    :param s3_client: The pre-configured s3_client.
+    :type s3_client: BaseClient
+    :param bucket_name: The name of the bucket the object is stored in.
+    :type bucket_name: str
+    :param key: The path on S3 (excl bucket name) of the object to download.
+    :type key: str
+    :param dest_path: The local path to write the object to. Overwritten if it already exists. Raises an OSError with
+        errno ENOSPC before downloading anything if there isn't room for the object.
+    :type dest_path: str
+    :param part_size: The size in bytes of each ranged GET, defaults to 8MB.
+    :type part_size: int
+    :param concurrency: The maximum number of ranged GETs in flight at once, defaults to 16.
+    :type concurrency: int
+    :param read_size: The size in bytes of each read from a part's response body, defaults to 1MB.
+    :type read_size: int
+    :return: The local path the object was written to.
+    :rtype: str
+    """
+    head = s3_client.head_object(Bucket=bucket_name, Key=key)
+    size = head["ContentLength"]
+    ranges = [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+
+    fd = os.open(dest_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        # reserve the space up front where the platform allows it, so a full disk fails before any part is fetched
+        if size and hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(fd, 0, size)
+        else:
+            os.ftruncate(fd, size)
+
+        def fetch_range(byte_range):
+            start, end = byte_range
+            # pin every part to the ETag from the HEAD so the object can't change part way through the download
+            part = s3_client.get_object(Bucket=bucket_name, Key=key, Range="bytes={0}-{1}".format(start, end),
+                                        IfMatch=head["ETag"])
+            offset = start
+            for chunk in part["Body"].iter_chunks(chunk_size=read_size):
+                os.pwrite(fd, chunk, offset)
+                offset += len(chunk)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            # consume the results so that any error raised in a worker is re-raised here
+            list(executor.map(fetch_range, ranges))
+    finally:
+        os.close(fd)
+
+    return dest_path
@@ -1,19 +1,96 @@
 import os
 import struct
+import tempfile
 from unittest import TestCase, mock, main
 import logging
 import warnings
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor
+import pyreadstat
 from pandas import DataFrame
 
 from botocore.client import BaseClient
 from botocore.exceptions import ClientError
-from botocore.response import StreamingBody
 from pyreadstat._readstat_parser import ReadstatError
 
 from convert_to_csv.src import s3_connector
 from convert_to_csv.src import file_to_csv
 from . import super_env
 
+s3_env = super_env.get_s3_env()
+env_patcher = mock.patch.dict(os.environ, s3_env)
+
+
+def setUpModule():
+    env_patcher.start()
+    s3_connector.get_conn_details.cache_clear()
+    logging.disable(logging.CRITICAL)
+    warnings.filterwarnings(action="ignore", message="unclosed", category=ResourceWarning)
+
+
+def tearDownModule():
+    env_patcher.stop()
+    s3_connector.get_conn_details.cache_clear()
+    logging.disable(logging.NOTSET)
+
+
+# the ledgers are read-only views so that no test can replace their top-level fields for the tests that run after
+# it; the nested attributes dicts are still shared and mutable, so tests must copy a ledger before changing them
+RAW_SPSS_LEDGER = MappingProxyType({
+    "attributes": {
+        "file_type": "spss",
+        "targetclassification": "testclass"
+    },
+    "location_details": "s3a://pseudo/spss/survey.sav",
+    "label": "",
+    "version": "",
+    "group_count": ""
+})
+
+RAW_STATA_LEDGER = MappingProxyType({
+    "attributes": {
+        "file_type": "stata",
+        "targetclassification": "testclass"
+    },
+    "location_details": "s3a://pseudo/stata/ch6data.dta",
+    "label": "",
+    "version": "",
+    "group_count": ""
+})
+
+INVALID_LOCATION_LEDGER = MappingProxyType({
+    "attributes": {
+        "file_type": "stata",
+        "targetclassification": "testclass"
+    },
+    "location_details": "s3a://pseudo/not/a/file.dta",
+    "label": "",
+    "version": "",
+    "group_count": ""
+})
+
+INVALID_TYPE_LEDGER = MappingProxyType({
+    "attributes": {
+        "file_type": "invalid_type",
+        "targetclassification": "testclass"
+    },
+    "location_details": "s3a://pseudo/stata/ch6data.dta",
+    "label": "",
+    "version": "",
+    "group_count": ""
+})
+
+NOT_S3_LEDGER = MappingProxyType({
+    "attributes": {
+        "file_type": "spss",
+        "targetclassification": "testclass"
+    },
+    "location_details": "hdfs://not/a/file/path.dta",
+    "label": "",
+    "version": "",
+    "group_count": ""
+})
+
 
 class Test(TestCase):
     bucket = "pseudo"
@@ -26,76 +103,21 @@ class Test(TestCase):
     invalid_fileloc_ledger_path = "test/invalid_file.json"
     not_s3_ledger_path = "test/not_s3.json"
     run_id = "test_run_id"
-    raw_spss_ledger = {
-        "attributes": {
-            "file_type": "spss",
-            "targetclassification": "testclass"
-        },
-        "location_details": "s3a://pseudo/spss/survey.sav",
-        "label": "",
-        "version": "",
-        "group_count": ""
-    }
-    raw_stata_ledger = {
-        "attributes": {
-            "file_type": "stata",
-            "targetclassification": "testclass"
-        },
-        "location_details": "s3a://pseudo/stata/ch6data.dta",
-        "label": "",
-        "version": "",
-        "group_count": ""
-    }
-    invalid_location_ledger = {
-        "attributes": {
-            "file_type": "stata",
-            "targetclassification": "testclass"
-        },
-        "location_details": "s3a://pseudo/not/a/file.dta",
-        "label": "",
-        "version": "",
-        "group_count": ""
-    }
-    invalid_type_ledger = {
-        "attributes": {
-            "file_type": "invalid_type",
-            "targetclassification": "testclass"
-        },
-        "location_details": "s3a://pseudo/stata/ch6data.dta",
-        "label": "",
-        "version": "",
-        "group_count": ""
-    }
-    not_s3_ledger = {
-        "attributes": {
-            "file_type": "spss",
-            "targetclassification": "testclass"
-        },
-        "location_details": "hdfs://not/a/file/path.dta",
-        "label": "",
-        "version": "",
-        "group_count": ""
-    }
 
     @classmethod
-    def setUpClass(cls, raw_spss_ledger=raw_spss_ledger, spss_ledger_path=spss_ledger_path,
-                   raw_stata_ledger=raw_stata_ledger, stata_ledger_path=stata_ledger_path,
-                   invalid_location_ledger=invalid_location_ledger,
+    def setUpClass(cls, spss_ledger_path=spss_ledger_path, stata_ledger_path=stata_ledger_path,
                    invalid_fileloc_ledger_path=invalid_fileloc_ledger_path,
-                   invalid_type_ledger=invalid_type_ledger, invalid_type_ledger_path=invalid_type_ledger_path,
-                   not_s3_ledger=not_s3_ledger, not_s3_ledger_path=not_s3_ledger_path, bucket=bucket):
-        env_vars = super_env.get_s3_env()
-        cls.env_patcher = mock.patch.dict(os.environ, env_vars)
-        cls.env_patcher.start()
-        logging.disable(logging.CRITICAL)
-        warnings.filterwarnings(action="ignore", message="unclosed", category=ResourceWarning)
-
-        s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
-        s3_connector.put_item(raw_spss_ledger, bucket, spss_ledger_path, s3_client)
-        s3_connector.put_item(raw_stata_ledger, bucket, stata_ledger_path, s3_client)
-        s3_connector.put_item(invalid_type_ledger, bucket, invalid_type_ledger_path, s3_client)
-        s3_connector.put_item(invalid_location_ledger, bucket, invalid_fileloc_ledger_path, s3_client)
-        s3_connector.put_item(not_s3_ledger, bucket, not_s3_ledger_path, s3_client)
+                   invalid_type_ledger_path=invalid_type_ledger_path, not_s3_ledger_path=not_s3_ledger_path,
+                   bucket=bucket):
+        # one client for the whole class, shared by the fixtures and passed into the functions under test
+        cls.s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
+        # the ledger puts are independent of each other, so overlap their round trips to S3
+        ledgers = [(RAW_SPSS_LEDGER, spss_ledger_path), (RAW_STATA_LEDGER, stata_ledger_path),
+                   (INVALID_TYPE_LEDGER, invalid_type_ledger_path),
+                   (INVALID_LOCATION_LEDGER, invalid_fileloc_ledger_path), (NOT_S3_LEDGER, not_s3_ledger_path)]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda ledger: s3_connector.put_item(dict(ledger[0]), bucket, ledger[1],
+                                                                   cls.s3_client), ledgers))
 
         super().setUpClass()
 
@@ -104,54 +126,92 @@ class Test(TestCase):
                       invalid_file_ledger_path=invalid_fileloc_ledger_path, project=project, run_id=run_id,
                       invalid_type_ledger_path=invalid_type_ledger_path, not_s3_ledger_path=not_s3_ledger_path):
         super().tearDownClass()
-        s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
         # delete the test ledgers
-        for ledger_loc in [spss_ledger_path, stata_ledger_path, invalid_file_ledger_path, invalid_type_ledger_path,
-                           not_s3_ledger_path]:
-            s3_client.delete_object(Bucket=bucket, Key=ledger_loc)
-
-        for file in s3_client.list_objects_v2(Bucket=bucket, Prefix=project+"/jobs")["Contents"]:
-            s3_client.delete_object(Bucket=bucket, Key=file["Key"])
-
-        logging.disable(logging.NOTSET)
-        cls.env_patcher.stop()
-
-    def test_put_converted_file_s3_spss(self, bucket_name=bucket, run_id=run_id, project_code=project,
-                                        ledger=raw_spss_ledger):
-        file_to_convert_path = ledger["location_details"]
-        file_to_convert = file_to_csv.get_target_file(file_to_convert_path)
+        ledger_locs = [spss_ledger_path, stata_ledger_path, invalid_file_ledger_path, invalid_type_ledger_path,
+                       not_s3_ledger_path]
+        cls.s3_client.delete_objects(Bucket=bucket, Delete={
+            "Objects": [{"Key": key} for key in ledger_locs],
+            "Quiet": True
+        })
+        # and everything the tests wrote under the jobs prefix, a page of at most 1000 keys per multi-object delete
+        # (the most S3 takes in one request), so only one page is held in memory however much was left behind
+        pages = cls.s3_client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=project + "/jobs")
+        for page in pages:
+            if "Contents" in page:
+                cls.s3_client.delete_objects(Bucket=bucket, Delete={
+                    "Objects": [{"Key": file["Key"]} for file in page["Contents"]],
+                    "Quiet": True
+                })
+
+    def test_put_converted_file_s3_spss(self, bucket_name=bucket, run_id=run_id, project_code=project):
+        file_to_convert_path = RAW_SPSS_LEDGER["location_details"]
+        file_to_convert = file_to_csv.get_target_file(file_to_convert_path, self.s3_client)
         main_df, secondary_dfs = file_to_csv.convert_spss(file_to_convert, file_to_convert_path)
 
         converted_csv_name = file_to_convert_path.split("/")[-1].split(".")[0]
         converted_csv_path = "{0}/jobs/{1}/converted_files/{2}.csv".format(project_code, run_id, converted_csv_name)
 
         result = file_to_csv.put_converted_file_s3(main_df, secondary_dfs, bucket_name, project_code, run_id,
-                                                   file_to_convert_path)
+                                                   file_to_convert_path, self.s3_client)
 
         self.assertEqual(result, converted_csv_path)
 
-    def test_put_converted_file_s3_stata(self, bucket_name=bucket, run_id=run_id, project_code=project,
-                                         ledger=raw_stata_ledger):
-        file_to_convert_path = ledger["location_details"]
-        file_to_convert = file_to_csv.get_target_file(file_to_convert_path)
+    def test_put_converted_file_s3_stata(self, bucket_name=bucket, run_id=run_id, project_code=project):
+        file_to_convert_path = RAW_STATA_LEDGER["location_details"]
+        file_to_convert = file_to_csv.get_target_file(file_to_convert_path, self.s3_client)
         main_df, secondary_dfs = file_to_csv.convert_stata(file_to_convert, file_to_convert_path)
 
         converted_csv_name = file_to_convert_path.split("/")[-1].split(".")[0]
         converted_csv_path = "{0}/jobs/{1}/converted_files/{2}.csv".format(project_code, run_id, converted_csv_name)
 
         result = file_to_csv.put_converted_file_s3(main_df, secondary_dfs, bucket_name, project_code, run_id,
-                                                   file_to_convert_path)
+                                                   file_to_convert_path, self.s3_client)
 
         self.assertEqual(result, converted_csv_path)
 
-    def test_put_converted_file_s3_fake_bucket(self, run_id=run_id, project_code=project, ledger=raw_stata_ledger):
+    def assert_no_values_file(self, local_file, target_file_path, convert, bucket_name, project_code, run_id):
+        main_df, secondary_dfs = convert(local_file, target_file_path)
+        self.assertIsNone(secondary_dfs["-values"])
+
+        converted_csv_path = file_to_csv.put_converted_file_s3(main_df, secondary_dfs, bucket_name, project_code,
+                                                               run_id, target_file_path, self.s3_client)
+        self.addCleanup(self.s3_client.delete_object, Bucket=bucket_name, Key=converted_csv_path)
+
+        converted_name = target_file_path.split("/")[-1].split(".")[0]
+        prefix = "{0}/jobs/{1}/converted_files/{2}-".format(project_code, run_id, converted_name)
+        written = [item["Key"] for item in
+                   self.s3_client.list_objects_v2(Bucket=bucket_name, Prefix=prefix).get("Contents", [])]
+        self.assertNotIn(prefix + "values.csv", written)
+        return written
+
+    def test_put_converted_file_s3_unlabelled_spss(self, bucket_name=bucket, run_id=run_id, project_code=project):
+        fd, local_file = tempfile.mkstemp(suffix=".sav")
+        os.close(fd)
+        pyreadstat.write_sav(DataFrame({"a": [1.0, 2.0], "b": ["x", "y"]}), local_file)
+
+        written = self.assert_no_values_file(local_file, "test/unlabelled_spss.sav", file_to_csv.convert_spss,
+                                             bucket_name, project_code, run_id)
+        # the description is still written, only the empty values file is skipped
+        self.assertEqual(written, ["{0}/jobs/{1}/converted_files/unlabelled_spss-description.csv".format(project_code,
+                                                                                                        run_id)])
+
+    def test_put_converted_file_s3_unlabelled_stata(self, bucket_name=bucket, run_id=run_id, project_code=project):
+        fd, local_file = tempfile.mkstemp(suffix=".dta")
+        os.close(fd)
+        DataFrame({"a": [1, 2], "b": ["x", "y"]}).to_stata(local_file, write_index=False)
+
+        written = self.assert_no_values_file(local_file, "test/unlabelled_stata.dta", file_to_csv.convert_stata,
+                                             bucket_name, project_code, run_id)
+        self.assertEqual(written, [])
+
+    def test_put_converted_file_s3_fake_bucket(self, run_id=run_id, project_code=project):
         bucket_name = "notabucket"
-        file_to_convert_path = ledger["location_details"]
-        file_to_convert = file_to_csv.get_target_file(file_to_convert_path)
+        file_to_convert_path = RAW_STATA_LEDGER["location_details"]
+        file_to_convert = file_to_csv.get_target_file(file_to_convert_path, self.s3_client)
         main_df, secondary_dfs = file_to_csv.convert_stata(file_to_convert, file_to_convert_path)
 
         self.assertRaises(ClientError, file_to_csv.put_converted_file_s3, main_df, secondary_dfs, bucket_name,
-                          project_code, run_id, file_to_convert_path)
+                          project_code, run_id, file_to_convert_path, self.s3_client)
 
     def test_main_valid_spss(self, bucket=bucket, project=project, ledger_path=spss_ledger_path, run_id=run_id):
         result = file_to_csv.main(bucket, project, ledger_path, run_id)
@@ -1,6 +1,10 @@
+import os
+
+
 def get_s3_env():
+    # TEST_S3_ENDPOINT points the suite at another S3 service, e.g. a local moto_server, instead of the minikube MinIO
     return {
-        "S3_ENDPOINT": "http://192.168.49.1:9000",
+        "S3_ENDPOINT": os.getenv("TEST_S3_ENDPOINT", "http://192.168.49.1:9000"),
         "S3_ACCESS_KEY": "admin",
         "S3_ACCESS_SECRET": "MyP4ssW0rd"
     }
\ No newline at end of file
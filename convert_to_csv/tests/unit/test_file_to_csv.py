@@ -1,19 +1,80 @@
+import csv
+import datetime
 import os
 import struct
+import tempfile
 from unittest import TestCase, mock, main
 import logging
 import warnings
-from pandas import DataFrame
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor
+from pandas import DataFrame, to_datetime
+from pandas.testing import assert_frame_equal
+from pyarrow import Table
 
 from botocore.client import BaseClient
 from botocore.exceptions import ClientError
-from botocore.response import StreamingBody
 from pyreadstat._readstat_parser import ReadstatError
 
 from convert_to_csv.src import s3_connector
 from convert_to_csv.src import file_to_csv
 from . import super_env
 
+s3_env = super_env.get_s3_env()
+env_patcher = mock.patch.dict(os.environ, s3_env)
+
+
+def setUpModule():
+    env_patcher.start()
+    s3_connector.get_conn_details.cache_clear()
+    # silence logging and boto's unclosed socket warnings once for the whole module
+    logging.disable(logging.CRITICAL)
+    warnings.filterwarnings(action="ignore", message="unclosed", category=ResourceWarning)
+
+
+def tearDownModule():
+    env_patcher.stop()
+    s3_connector.get_conn_details.cache_clear()
+    logging.disable(logging.NOTSET)
+
+
+# the ledgers are read-only views so that no test can replace their top-level fields for the tests that run after
+# it; the nested attributes dicts are still shared and mutable, so tests must copy a ledger before changing them
+RAW_SPSS_LEDGER = MappingProxyType({
+    "attributes": {
+        "file_type": "spss",
+        "targetclassification": "testclass"
+    },
+    "location_details": "s3a://pseudo/spss/survey.sav",
+    "label": "",
+    "version": "",
+    "group_count": ""
+})
+
+RAW_STATA_LEDGER = MappingProxyType({
+    "attributes": {
+        "file_type": "stata",
+        "targetclassification": "testclass"
+    },
+    "location_details": "s3a://pseudo/stata/ch6data.dta",
+    "label": "",
+    "version": "",
+    "group_count": ""
+})
+
+# A frame covering the cases the csv writers have to agree on: values that need quoting, missing values in every column,
+# fractional floats, dates, timestamps at midnight, to the second and to the millisecond, and times
+CSV_FRAME = DataFrame({
+    "id": [1, 2, 3, 4],
+    "name, quoted": ["plain", "a,b", None, 'say "hi"'],
+    "ratio": [0.5, None, 2.25, 0.001],
+    "day": [datetime.date(2020, 1, 1), None, datetime.date(2020, 1, 3), datetime.date(2020, 1, 4)],
+    "midnight": to_datetime(["2020-01-01", "2020-01-02", None, "2020-01-04"]),
+    "seconds": to_datetime(["2020-01-01 01:02:03", "2020-01-02", None, "2020-01-04"]),
+    "millis": to_datetime(["2020-01-01 01:02:03.5", "2020-01-02", None, "2020-01-04"]),
+    "clock": [datetime.time(1, 2, 3), None, datetime.time(4, 5, 6), datetime.time(0, 0)]
+})
+
 
 class Test(TestCase):
     bucket = "pseudo"
@@ -23,39 +84,25 @@ class Test(TestCase):
     run_id = "test_run_id"
     spss_converted_path = "test/converted_spss.csv"
     stata_converted_path = "test/converted_stata.csv"
-    raw_spss_ledger = {
-        "attributes": {
-            "file_type": "spss",
-            "targetclassification": "testclass"
-         },
-        "location_details": "s3a://pseudo/spss/survey.sav",
-        "label": "",
-        "version": "",
-        "group_count": ""
-    }
-    raw_stata_ledger = {
-        "attributes": {
-            "file_type": "stata",
-            "targetclassification": "testclass"
-        },
-        "location_details": "s3a://pseudo/stata/ch6data.dta",
-        "label": "",
-        "version": "",
-        "group_count": ""
-    }
+    # the suffixes of the extra frames each converter may return
+    spss_extra_names = frozenset(("-values", "-description"))
+    stata_extra_names = frozenset(("-values",))
 
     @classmethod
-    def setUpClass(cls, raw_spss_ledger=raw_spss_ledger, spss_ledger_path=spss_ledger_path,
-                   raw_stata_ledger=raw_stata_ledger, stata_ledger_path=stata_ledger_path, bucket=bucket):
-        env_vars = super_env.get_s3_env()
-        cls.env_patcher = mock.patch.dict(os.environ, env_vars)
-        cls.env_patcher.start()
-        logging.disable(logging.CRITICAL)
-        warnings.filterwarnings(action="ignore", message="unclosed", category=ResourceWarning)
-
-        s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
-        s3_connector.put_item(raw_spss_ledger, bucket, spss_ledger_path, s3_client)
-        s3_connector.put_item(raw_stata_ledger, bucket, stata_ledger_path, s3_client)
+    def setUpClass(cls, spss_ledger_path=spss_ledger_path, stata_ledger_path=stata_ledger_path, bucket=bucket):
+        # one client for the whole class, shared by the fixtures and passed into the functions under test
+        cls.s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
+        # the ledger puts are independent of each other, so overlap their round trips to S3
+        ledgers = [(RAW_SPSS_LEDGER, spss_ledger_path), (RAW_STATA_LEDGER, stata_ledger_path)]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda ledger: s3_connector.put_item(dict(ledger[0]), bucket, ledger[1],
+                                                                   cls.s3_client), ledgers))
+
+        # download and parse each survey file once; the convert tests all assert against these shared results
+        spss_path = RAW_SPSS_LEDGER["location_details"]
+        cls.spss_result = file_to_csv.convert_spss(file_to_csv.get_target_file(spss_path, cls.s3_client), spss_path)
+        stata_path = RAW_STATA_LEDGER["location_details"]
+        cls.stata_result = file_to_csv.convert_stata(file_to_csv.get_target_file(stata_path, cls.s3_client), stata_path)
 
         super().setUpClass()
 
@@ -63,34 +110,41 @@ class Test(TestCase):
     def tearDownClass(cls, bucket=bucket, spss_ledger_path=spss_ledger_path, stata_ledger_path=stata_ledger_path,
                       project=project, run_id=run_id):
         super().tearDownClass()
-        s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
         # delete the test ledgers
-        for ledger_loc in [spss_ledger_path, stata_ledger_path]:
-            s3_client.delete_object(Bucket=bucket, Key=ledger_loc)
-        logging.disable(logging.NOTSET)
-        cls.env_patcher.stop()
-
-    def test_get_ledger_spss(self, bucket_name=bucket, spss_ledger_path=spss_ledger_path, raw_ledger=raw_spss_ledger):
-        result_ledger, file_to_convert_loc = file_to_csv.get_ledger(spss_ledger_path, bucket_name)
-        self.assertEqual(result_ledger, raw_ledger)
-        self.assertEqual(file_to_convert_loc, raw_ledger["location_details"])
-
-    def test_get_ledger_stata(self, bucket_name=bucket, stata_ledger_path=stata_ledger_path, raw_ledger=raw_stata_ledger):
-        result_ledger, file_to_convert_loc = file_to_csv.get_ledger(stata_ledger_path, bucket_name)
-        self.assertEqual(result_ledger, raw_ledger)
-        self.assertEqual(file_to_convert_loc, raw_ledger["location_details"])
-
-    def test_get_target_file_spss(self, raw_ledger=raw_spss_ledger):
-        spss_path = raw_ledger["location_details"]
-        result = file_to_csv.get_target_file(spss_path)
-        self.assertIsInstance(result, StreamingBody)
-        self.assertIsInstance(result.read(), bytes)
-
-    def test_get_target_file_stata(self, raw_ledger=raw_stata_ledger):
-        stata_path = raw_ledger["location_details"]
-        result = file_to_csv.get_target_file(stata_path)
-        self.assertIsInstance(result, StreamingBody)
-        self.assertIsInstance(result.read(), bytes)
+        cls.s3_client.delete_objects(Bucket=bucket, Delete={
+            "Objects": [{"Key": ledger_loc} for ledger_loc in [spss_ledger_path, stata_ledger_path]],
+            "Quiet": True
+        })
+
+    def test_get_ledger_spss(self, bucket_name=bucket, spss_ledger_path=spss_ledger_path):
+        result_ledger, file_to_convert_loc = file_to_csv.get_ledger(spss_ledger_path, bucket_name, self.s3_client)
+        self.assertEqual(result_ledger, RAW_SPSS_LEDGER)
+        self.assertEqual(file_to_convert_loc, RAW_SPSS_LEDGER["location_details"])
+
+    def test_get_ledger_stata(self, bucket_name=bucket, stata_ledger_path=stata_ledger_path):
+        result_ledger, file_to_convert_loc = file_to_csv.get_ledger(stata_ledger_path, bucket_name, self.s3_client)
+        self.assertEqual(result_ledger, RAW_STATA_LEDGER)
+        self.assertEqual(file_to_convert_loc, RAW_STATA_LEDGER["location_details"])
+
+    def test_get_target_file_spss(self):
+        spss_path = RAW_SPSS_LEDGER["location_details"]
+        result = file_to_csv.get_target_file(spss_path, self.s3_client)
+        self.assertIsInstance(result, str)
+        self.assertTrue(os.path.isfile(result))
+        # check the whole object landed on disk by its size alone, without reading it back
+        expected_size = self.s3_client.head_object(Bucket=self.bucket, Key="spss/survey.sav")["ContentLength"]
+        self.assertEqual(os.path.getsize(result), expected_size)
+        os.remove(result)
+
+    def test_get_target_file_stata(self):
+        stata_path = RAW_STATA_LEDGER["location_details"]
+        result = file_to_csv.get_target_file(stata_path, self.s3_client)
+        self.assertIsInstance(result, str)
+        self.assertTrue(os.path.isfile(result))
+        # check the whole object landed on disk by its size alone, without reading it back
+        expected_size = self.s3_client.head_object(Bucket=self.bucket, Key="stata/ch6data.dta")["ContentLength"]
+        self.assertEqual(os.path.getsize(result), expected_size)
+        os.remove(result)
 
     def test_get_target_file_nons3_location(self):
         file_path = "HDFS://this/is/not/a/path.spss"
@@ -98,94 +152,201 @@ class Test(TestCase):
 
     def test_get_target_file_s3_invalid_file(self):
         file_path = "s3a://pseudo/a/fake/path.spss"
-        self.assertRaises(ClientError, file_to_csv.get_target_file, file_path)
+        self.assertRaises(ClientError, file_to_csv.get_target_file, file_path, self.s3_client)
 
     def test_get_target_file_s3_invalid_bucket(self):
         file_path = "s3a://this/is/not/a/bucket.file"
-        self.assertRaises(ClientError, file_to_csv.get_target_file, file_path)
+        self.assertRaises(ClientError, file_to_csv.get_target_file, file_path, self.s3_client)
 
-    def test_convert_spss_main_df(self, raw_ledger=raw_spss_ledger):
-        loaded_path = raw_ledger["location_details"]
-        loaded_file = file_to_csv.get_target_file(loaded_path)
-        result_df, other_dfs = file_to_csv.convert_spss(loaded_file, loaded_path)
-        self.assertIsInstance(result_df, DataFrame)
+    def test_convert_spss_main_df(self):
+        result_df, other_dfs = self.spss_result
+        self.assertIsInstance(result_df, Table)
 
-    def test_convert_spss_value_df(self, raw_ledger=raw_spss_ledger):
-        loaded_path = raw_ledger["location_details"]
-        loaded_file = file_to_csv.get_target_file(loaded_path)
-        result_df, other_dfs = file_to_csv.convert_spss(loaded_file, loaded_path)
+    def test_convert_spss_value_df(self):
+        result_df, other_dfs = self.spss_result
         self.assertIsInstance(other_dfs, dict)
         for name, frame in other_dfs.items():
-            self.assertIn(name, ["-values", "-description"])
+            self.assertIn(name, self.spss_extra_names)
             self.assertIsInstance(frame, DataFrame)
         val_df = other_dfs["-values"]
-        self.assertCountEqual(val_df.columns, ["Field", "Code", "Meaning"])
+        self.assertEqual(list(val_df.columns), ["Field", "Code", "Meaning"])
 
-    def test_convert_spss_desc_df(self, raw_ledger=raw_spss_ledger):
-        loaded_path = raw_ledger["location_details"]
-        loaded_file = file_to_csv.get_target_file(loaded_path)
-        result_df, other_dfs = file_to_csv.convert_spss(loaded_file, loaded_path)
+    def test_convert_spss_desc_df(self):
+        result_df, other_dfs = self.spss_result
         self.assertIsInstance(other_dfs, dict)
         des_df = other_dfs["-description"]
-        self.assertCountEqual(des_df.columns, ["Field", "Meaning"])
+        self.assertEqual(list(des_df.columns), ["Field", "Meaning"])
 
     def test_convert_spss_empty_sav(self):
         loaded_path = "s3a://pseudo/spss/empty.sav"
-        loaded_file = file_to_csv.get_target_file(loaded_path)
+        loaded_file = file_to_csv.get_target_file(loaded_path, self.s3_client)
         self.assertRaises(ReadstatError, file_to_csv.convert_spss, loaded_file, loaded_path)
 
     def test_convert_spss_corrupt_sav(self):
         loaded_path = "s3a://pseudo/spss/invalid_spss.sav"
-        loaded_file = file_to_csv.get_target_file(loaded_path)
+        loaded_file = file_to_csv.get_target_file(loaded_path, self.s3_client)
         self.assertRaises(ReadstatError, file_to_csv.convert_spss, loaded_file, loaded_path)
 
-    def test_convert_stata_main_df(self, raw_ledger=raw_stata_ledger):
-        loaded_path = raw_ledger["location_details"]
-        loaded_file = file_to_csv.get_target_file(loaded_path)
-        result_df, other_dfs = file_to_csv.convert_stata(loaded_file, loaded_path)
-        self.assertIsInstance(result_df, DataFrame)
+    def test_convert_stata_main_df(self):
+        result_df, other_dfs = self.stata_result
+        self.assertIsInstance(result_df, Table)
 
-    def test_convert_stata_value_df(self, raw_ledger=raw_stata_ledger):
-        loaded_path = raw_ledger["location_details"]
-        loaded_file = file_to_csv.get_target_file(loaded_path)
-        result_df, other_dfs = file_to_csv.convert_stata(loaded_file, loaded_path)
+    def test_convert_stata_value_df(self):
+        result_df, other_dfs = self.stata_result
         self.assertIsInstance(other_dfs, dict)
         for name, frame in other_dfs.items():
-            self.assertIn(name, ["-values"])
+            self.assertIn(name, self.stata_extra_names)
             self.assertIsInstance(frame, DataFrame)
         val_df = other_dfs["-values"]
-        self.assertCountEqual(val_df.columns, ["Field", "Code", "Meaning"])
+        self.assertEqual(list(val_df.columns), ["Field", "Code", "Meaning"])
+
+    def test_convert_stata_partially_labelled(self):
+        # only some of the codes in column a are labelled, so pandas reads it as a category mixing label strings with
+        # raw codes, which Arrow can't type
+        fd, local_file = tempfile.mkstemp(suffix=".dta")
+        os.close(fd)
+        DataFrame({"a": [1, 2, 3], "b": [1.5, 2.5, 3.5]}).to_stata(local_file, write_index=False,
+                                                                   value_labels={"a": {1: "one", 2: "two"}})
+        result_df, other_dfs = file_to_csv.convert_stata(local_file, "s3a://pseudo/stata/partial.dta")
+        self.assertIsInstance(result_df, DataFrame)
+        self.assertEqual(b"".join(file_to_csv.csv_chunks(result_df, minimal_quoting=True)),
+                         b"a,b\none,1.5\ntwo,2.5\n3,3.5\n")
 
     def test_convert_stata_empty_dta(self):
         loaded_path = "s3a://pseudo/stata/empty.dta"
-        loaded_file = file_to_csv.get_target_file(loaded_path)
+        loaded_file = file_to_csv.get_target_file(loaded_path, self.s3_client)
         self.assertRaises(struct.error, file_to_csv.convert_stata, loaded_file, loaded_path)
 
     def test_convert_stata_corrupt_dta(self):
         loaded_path = "s3a://pseudo/stata/invalid_stata.dta"
-        loaded_file = file_to_csv.get_target_file(loaded_path)
+        loaded_file = file_to_csv.get_target_file(loaded_path, self.s3_client)
         self.assertRaises(ValueError, file_to_csv.convert_stata, loaded_file, loaded_path)
 
-    def test_convert_stata_given_spss(self, ledger=raw_spss_ledger):
-        loaded_path = ledger["location_details"]
-        loaded_file = file_to_csv.get_target_file(loaded_path)
+    def test_convert_stata_given_spss(self):
+        loaded_path = RAW_SPSS_LEDGER["location_details"]
+        loaded_file = file_to_csv.get_target_file(loaded_path, self.s3_client)
         self.assertRaises(ValueError, file_to_csv.convert_stata, loaded_file, loaded_path)
 
     def test_check_converted_file_spss(self, location=spss_converted_path, bucket_name=bucket):
-        result = file_to_csv.check_converted_file(bucket_name, location)
+        result = file_to_csv.check_converted_file(bucket_name, location, self.s3_client)
         self.assertEqual(result, True)
 
     def test_check_converted_file_stata(self, location=stata_converted_path, bucket_name=bucket):
-        result = file_to_csv.check_converted_file(bucket_name, location)
+        result = file_to_csv.check_converted_file(bucket_name, location, self.s3_client)
         self.assertEqual(result, True)
 
     def test_check_converted_file_missing(self, bucket_name=bucket):
         location = "test/not/a/path.csv"
-        self.assertRaises(ClientError, file_to_csv.check_converted_file, bucket_name, location)
+        self.assertRaises(ClientError, file_to_csv.check_converted_file, bucket_name, location, self.s3_client)
 
     def test_check_converted_file_wrong_bucket(self, location=spss_converted_path):
         bucket_name = "notabucket"
-        self.assertRaises(ClientError, file_to_csv.check_converted_file, bucket_name, location)
+        self.assertRaises(ClientError, file_to_csv.check_converted_file, bucket_name, location, self.s3_client)
+
+    def test_bucket_missing(self, bucket_name=bucket):
+        self.assertFalse(file_to_csv.bucket_missing(self.s3_client, bucket_name))
+        self.assertTrue(file_to_csv.bucket_missing(self.s3_client, "notabucket"))
+
+    @mock.patch.object(file_to_csv.os, "sched_getaffinity", return_value=set(range(16)), create=True)
+    def test_available_cpus(self, sched_getaffinity):
+        # a cgroup v2 limit of 1.5 CPUs, no limit, no cgroup files at all, and a cgroup v1 limit of half a CPU
+        cases = [(["150000 100000\n"], 2), (["max 100000\n"], 16), ([OSError, OSError], 16),
+                 ([OSError, "50000\n", "100000\n"], 1)]
+        for files, expected in cases:
+            opened = [item if item is OSError else mock.mock_open(read_data=item).return_value for item in files]
+            with mock.patch.object(file_to_csv, "open", side_effect=opened, create=True):
+                self.assertEqual(file_to_csv.available_cpus(), expected, files)
+
+    def test_csv_chunks_matches_pandas(self):
+        expected = CSV_FRAME.to_csv(index=False).encode()
+        # one row per block puts the values that need quoting in blocks of their own, between unquoted blocks
+        for rows_per_chunk in (1, 2, 8192):
+            result = b"".join(file_to_csv.csv_chunks(CSV_FRAME, minimal_quoting=True, rows_per_chunk=rows_per_chunk))
+            self.assertEqual(result, expected)
+
+    def test_csv_chunks_commas_in_many_blocks(self):
+        # a free-text column with a comma in every seventh row, so most blocks hold values that need quoting
+        frame = DataFrame({"id": range(1000), "text": ["a, b" if i % 7 == 0 else 'say "hi"' if i % 11 == 0 else "plain"
+                                                       for i in range(1000)]})
+        result = b"".join(file_to_csv.csv_chunks(frame, minimal_quoting=True, rows_per_chunk=64))
+        self.assertEqual(result, frame.to_csv(index=False).encode())
+
+    def test_csv_chunks_nonnumeric_quoting(self):
+        frame = CSV_FRAME[["id", "name, quoted"]].dropna()
+        result = b"".join(file_to_csv.csv_chunks(frame))
+        self.assertEqual(result, frame.to_csv(index=False, quoting=csv.QUOTE_NONNUMERIC).encode())
+
+    def test_csv_chunks_whole_floats(self):
+        # floats keep the text pandas gave them, so Spark still infers the column as a double
+        frame = DataFrame({"x": [1.0, 0.5, 1e-07, 1e16, None], "flag": [True, False, True, False, None]})
+        self.assertEqual(b"".join(file_to_csv.csv_chunks(frame, minimal_quoting=True)),
+                         frame.to_csv(index=False).encode())
+        self.assertEqual(b"".join(file_to_csv.csv_chunks(frame)),
+                         frame.to_csv(index=False, quoting=csv.QUOTE_NONNUMERIC).encode())
+
+    def test_csv_chunks_pandas_fallback(self):
+        # a column mixing numbers and strings can't be typed by Arrow, so the pandas writer is used block by block
+        frame = DataFrame({"Code": [1, "a", 2.5], "Meaning": ["one", "a, b", "two"]})
+        for minimal_quoting, quoting in ((True, csv.QUOTE_MINIMAL), (False, csv.QUOTE_NONNUMERIC)):
+            result = b"".join(file_to_csv.csv_chunks(frame, minimal_quoting=minimal_quoting, rows_per_chunk=1))
+            self.assertEqual(result, frame.to_csv(index=False, quoting=quoting).encode())
+
+    def test_csv_chunks_empty_frame(self):
+        frame = DataFrame({"a": [], "b": []})
+        self.assertEqual(b"".join(file_to_csv.csv_chunks(frame, minimal_quoting=True)), b"a,b\n")
+        self.assertEqual(b"".join(file_to_csv.csv_chunks(frame)), b'"a","b"\n')
+
+    def test_flatten_value_labels(self):
+        value_labels = {"sex": {1: "male", 2: "female"}, "answer": {1: "yes", 2: 'no, "never"', 9: "unsure"}}
+        # the label table as it was built before, one row at a time
+        expected = DataFrame(data=[[field, code, meaning] for field, codes in value_labels.items()
+                                   for code, meaning in codes.items()], columns=["Field", "Code", "Meaning"])
+        result = file_to_csv.flatten_value_labels(value_labels)
+        assert_frame_equal(result, expected)
+        self.assertEqual(b"".join(file_to_csv.csv_chunks(result)),
+                         expected.to_csv(index=False, quoting=csv.QUOTE_NONNUMERIC).encode())
+
+    @mock.patch.object(file_to_csv, "multipart_part_size", 1024)
+    def test_upload_csv_multipart(self):
+        # a stand-in client records the parts, with the part size cut down so a small frame spans several of them
+        s3_client = mock.MagicMock()
+        s3_client.create_multipart_upload.return_value = {"UploadId": "upload-id"}
+        s3_client.upload_part.side_effect = lambda **kwargs: {"ETag": "etag-{0}".format(kwargs["PartNumber"])}
+        frame = DataFrame({"id": range(20000), "name": ["row"] * 20000})
+
+        file_to_csv.upload_csv(frame, s3_client, "bucket", "path.csv", minimal_quoting=True)
+
+        # the parts upload in the background, so they may be sent out of order
+        part_calls = sorted(s3_client.upload_part.call_args_list, key=lambda call: call.kwargs["PartNumber"])
+        self.assertGreater(len(part_calls), 1)
+        self.assertEqual([call.kwargs["PartNumber"] for call in part_calls], list(range(1, len(part_calls) + 1)))
+        self.assertEqual(b"".join(call.kwargs["Body"] for call in part_calls),
+                         b"".join(file_to_csv.csv_chunks(frame, minimal_quoting=True)))
+        s3_client.complete_multipart_upload.assert_called_once_with(
+            Bucket="bucket", Key="path.csv", UploadId="upload-id",
+            MultipartUpload={"Parts": [{"PartNumber": n, "ETag": "etag-{0}".format(n)}
+                                       for n in range(1, len(part_calls) + 1)]})
+        s3_client.put_object.assert_not_called()
+
+    def test_upload_csv_single_put(self):
+        s3_client = mock.MagicMock()
+
+        file_to_csv.upload_csv(CSV_FRAME, s3_client, "bucket", "path.csv", minimal_quoting=True)
+
+        s3_client.put_object.assert_called_once_with(Bucket="bucket", Key="path.csv",
+                                                      Body=CSV_FRAME.to_csv(index=False).encode())
+        s3_client.create_multipart_upload.assert_not_called()
+
+    @mock.patch.object(file_to_csv, "multipart_part_size", 1024)
+    def test_upload_csv_aborts_on_error(self):
+        s3_client = mock.MagicMock()
+        s3_client.create_multipart_upload.return_value = {"UploadId": "upload-id"}
+        s3_client.upload_part.side_effect = ClientError({"Error": {"Code": "InternalError"}}, "UploadPart")
+        frame = DataFrame({"id": range(20000)})
+
+        self.assertRaises(ClientError, file_to_csv.upload_csv, frame, s3_client, "bucket", "path.csv")
+        s3_client.abort_multipart_upload.assert_called_once_with(Bucket="bucket", Key="path.csv",
+                                                                 UploadId="upload-id")
 
 
 if __name__ == "__main__":
@@ -1,11 +1,30 @@
+import filecmp
 import os
+import shutil
+import tempfile
 from unittest import TestCase, mock, main
 
 from botocore.client import BaseClient
+from botocore.exceptions import ClientError
 
-from expectations.src import s3_connector
+from convert_to_csv.src import s3_connector
 from . import super_env
 
+# the S3 environment is patched in once for the whole module
+s3_env = super_env.get_s3_env()
+env_patcher = mock.patch.dict(os.environ, s3_env)
+
+
+def setUpModule():
+    env_patcher.start()
+    # drop any connection details cached before the patch
+    s3_connector.get_conn_details.cache_clear()
+
+
+def tearDownModule():
+    env_patcher.stop()
+    s3_connector.get_conn_details.cache_clear()
+
 
 class Test(TestCase):
     new_bucket = "notabucket"
@@ -14,35 +33,34 @@ class Test(TestCase):
 
     @classmethod
     def setUpClass(cls):
-        env_vars = super_env.get_s3_env()
-        cls.env_patcher = mock.patch.dict(os.environ, env_vars)
-        cls.env_patcher.start()
+        # one client for the whole class, reused by every test
+        cls.s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
+        # scratch directory for the download tests, removed with everything in it at teardown
+        cls.tmpdir = tempfile.mkdtemp()
         super().setUpClass()
 
     @classmethod
     def tearDownClass(cls, new_bucket=new_bucket, existing_bucket=existing_bucket, target_path=target_path):
         super().tearDownClass()
-        s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
         # delete from the not-a-bucket
-        s3_client.delete_object(
+        cls.s3_client.delete_object(
             Bucket=new_bucket,
             Key=target_path
         )
-        s3_client.delete_bucket(
+        cls.s3_client.delete_bucket(
             Bucket=new_bucket
         )
-        s3_client.delete_object(
+        cls.s3_client.delete_object(
             Bucket=existing_bucket,
             Key=target_path
         )
-        cls.env_patcher.stop()
+        shutil.rmtree(cls.tmpdir, ignore_errors=True)
 
     def test_get_conn_details(self):
-        env_vars = super_env.get_s3_env()
         result = s3_connector.get_conn_details()
-        self.assertEqual(result["endpoint"], env_vars["S3_ENDPOINT"])
-        self.assertEqual(result["access_key"], env_vars["S3_ACCESS_KEY"])
-        self.assertEqual(result["access_secret"], env_vars["S3_ACCESS_SECRET"])
+        self.assertEqual(result["endpoint"], s3_env["S3_ENDPOINT"])
+        self.assertEqual(result["access_key"], s3_env["S3_ACCESS_KEY"])
+        self.assertEqual(result["access_secret"], s3_env["S3_ACCESS_SECRET"])
 
     def test_make_s3_client_invalid_endpoint(self):
         params = {
@@ -59,13 +77,26 @@ class Test(TestCase):
 
     def test_put_item_existing_bucket(self, bucket_name=existing_bucket, target_path=target_path):
         object_to_put = {"stuff": "nonsense"}
-        s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
-        self.assertTrue(s3_connector.put_item(object_to_put, bucket_name, target_path, s3_client))
+        self.assertTrue(s3_connector.put_item(object_to_put, bucket_name, target_path, self.s3_client))
 
     def test_put_item_nonexist_bucket_invalid_client(self, bucket_name=new_bucket, target_path=target_path):
         object_to_put = {"stuff": "nonsense"}
-        s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
-        self.assertTrue(s3_connector.put_item(object_to_put, bucket_name, target_path, s3_client))
+        self.assertTrue(s3_connector.put_item(object_to_put, bucket_name, target_path, self.s3_client))
+
+    def test_parallel_download(self):
+        bucket_name = "pseudo"
+        key = "spss/survey.sav"
+        dest_path = os.path.join(self.tmpdir, "parallel-download.sav")
+        # reference copy fetched by boto3's own transfer manager, compared on disk rather than read into memory
+        expected_path = os.path.join(self.tmpdir, "expected.sav")
+        self.s3_client.download_file(Bucket=bucket_name, Key=key, Filename=expected_path)
+        result = s3_connector.parallel_download(self.s3_client, bucket_name, key, dest_path, part_size=256,
+                                                read_size=100)
+        self.assertTrue(filecmp.cmp(result, expected_path, shallow=False))
+
+    def test_parallel_download_missing_key(self):
+        self.assertRaises(ClientError, s3_connector.parallel_download, self.s3_client, "pseudo", "not/a/file.sav",
+                          os.path.join(self.tmpdir, "missing.sav"))
 
 
 if __name__ == "__main__":
@@ -8,33 +8,34 @@ This file can be imported as a module and contains the following functions:
     * get_airflow_auth_conn - gets the authentication deals for Airflow managed services to connect to the NRDA API.
 
 """
+import functools
 import os
 
 
+@functools.lru_cache(maxsize=1)
 def get_nrda_conn() -> dict[str]:
     """Gets the endpoint URL for connecting to the NRDA API.
 
+    The environment is only read on the first call, later calls return the cached dictionary.
+
     :return: A dictionary with one key, host, with value of the NRDA API endpoint URL as a string.
     :rtype: dict
     """
-    try:
-        nrda_conn = {"host": os.environ["NRDAPI_HOST"]}
-        return nrda_conn
-    except KeyError as e:
-        raise KeyError(e)
+    nrda_conn = {"host": os.environ["NRDAPI_HOST"]}
+    return nrda_conn
 
 
+@functools.lru_cache(maxsize=1)
 def get_airflow_auth_conn() -> dict[str]:
     """Gets the authentication information for querying NRDA API from an Airflow-managed process.
 
+    Like get_nrda_conn, the credentials are read from the environment once and cached for the life of the process.
+
     :return: A dictionary with 3 connection keys required to query the NRDA API.
     :rtype: dict
     """
-    try:
-        af_oauth_conn = {"host": os.environ["AFOAUTH_HOST"],
-                         "login": os.environ["AFOAUTH_LOGIN"],
-                         "password": os.environ["AFOAUTH_PASS"]
-                         }
-        return af_oauth_conn
-    except KeyError as e:
-        raise KeyError(e)
+    af_oauth_conn = {"host": os.environ["AFOAUTH_HOST"],
+                     "login": os.environ["AFOAUTH_LOGIN"],
+                     "password": os.environ["AFOAUTH_PASS"]
+                     }
+    return af_oauth_conn
@@ -6,9 +6,20 @@ backend store for the Expectation Suite is a location on S3 that is defined in t
 
 """
 from great_expectations.data_context.types.base import DataContextConfig
+import paths
 import s3_connector
 
 
+def _s3_backend(bucket_name, prefix, endpoint_url, boto3_options) -> dict:
+    return {
+        "class_name": "TupleS3StoreBackend",
+        "bucket": bucket_name,
+        "prefix": prefix,
+        "endpoint_url": endpoint_url,
+        "boto3_options": boto3_options
+    }
+
+
 def get_expect_config(bucket_name, project_code, dag_run_id) -> DataContextConfig:
     """Get the configuration for a Great Expectations suite
 
@@ -28,6 +39,17 @@ def get_expect_config(bucket_name, project_code, dag_run_id) -> DataContextConfi
     :rtype: DataContextConfig
     """
     s3_conn = s3_connector.get_conn_details()
+    # every store writes through the same S3 connection, so the boto3 options are built once and shared
+    boto3_options = {
+        "aws_access_key_id": s3_conn['access_key'],
+        "aws_secret_access_key": s3_conn['access_secret'],
+        "endpoint_url": s3_conn['endpoint'],
+        "signature_version": "s3v4"
+    }
+    # the stores' prefixes are the same paths init_expects reports, with the trailing slash the S3 backend expects
+    expectations_prefix = paths.expect_store_key(project_code, dag_run_id) + "/"
+    validations_prefix = paths.validations_key(project_code, dag_run_id) + "/"
+    data_docs_prefix = paths.sitebuilder_key(project_code, dag_run_id) + "/"
 
     config = DataContextConfig(
         config_version=2,
@@ -48,33 +70,11 @@ def get_expect_config(bucket_name, project_code, dag_run_id) -> DataContextConfi
         stores={
             "expectations_store": {
                 "class_name": "ExpectationsStore",
-                "store_backend": {
-                    "class_name": "TupleS3StoreBackend",
-                    "bucket": bucket_name,
-                    "prefix": "{0}/jobs/{1}/ge_tmp/expectations/".format(project_code, dag_run_id),
-                    "endpoint_url": s3_conn['endpoint'],
-                    "boto3_options": {
-                        "aws_access_key_id": s3_conn['access_key'],
-                        "aws_secret_access_key": s3_conn['access_secret'],
-                        "endpoint_url": s3_conn['endpoint'],
-                        "signature_version": "s3v4"
-                    }
-                },
+                "store_backend": _s3_backend(bucket_name, expectations_prefix, s3_conn['endpoint'], boto3_options),
             },
             "validations_store": {
                 "class_name": "ValidationsStore",
-                "store_backend": {
-                    "class_name": "TupleS3StoreBackend",
-                    "bucket": bucket_name,
-                    "prefix": "{0}/jobs/{1}/ge_tmp/uncommitted/validations/".format(project_code, dag_run_id),
-                    "endpoint_url": s3_conn['endpoint'],
-                    "boto3_options": {
-                        "aws_access_key_id": s3_conn['access_key'],
-                        "aws_secret_access_key": s3_conn['access_secret'],
-                        "endpoint_url": s3_conn['endpoint'],
-                        "signature_version": "s3v4"
-                    }
-                },
+                "store_backend": _s3_backend(bucket_name, validations_prefix, s3_conn['endpoint'], boto3_options),
             },
             "evaluation_parameter_store": {"class_name": "EvaluationParameterStore"},
         },
@@ -84,18 +84,7 @@ def get_expect_config(bucket_name, project_code, dag_run_id) -> DataContextConfi
         data_docs_sites={
             "local_site": {
                 "class_name": "SiteBuilder",
-                "store_backend": {
-                    "class_name": "TupleS3StoreBackend",
-                    "bucket": bucket_name,
-                    "prefix": "{0}/jobs/{1}/ge_tmp/uncommitted/data_docs/local_site/".format(project_code, dag_run_id),
-                    "endpoint_url": s3_conn['endpoint'],
-                    "boto3_options": {
-                        "aws_access_key_id": s3_conn['access_key'],
-                        "aws_secret_access_key": s3_conn['access_secret'],
-                        "endpoint_url": s3_conn['endpoint'],
-                        "signature_version": "s3v4"
-                    }
-                },
+                "store_backend": _s3_backend(bucket_name, data_docs_prefix, s3_conn['endpoint'], boto3_options),
                 "site_index_builder": {
                     "class_name": "DefaultSiteIndexBuilder",
                     "show_cta_footer": True,
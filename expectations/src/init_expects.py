@@ -7,6 +7,9 @@ This file can be imported as a module and contains the following functions:
 
     * expectations_init - takes any existing expectation suite for the defined dataset and saves it to a temporary
         location in the S3 storage.
+    * save_expectations - saves existing expectations to a temporary location in the S3 storage.
+    * load_expectations - reads the ledger for the run from S3 and gets the existing expectation suite for the dataset
+        it defines.
     * get_expectations - connects to the NRDAv2 API to retrieve existing expectation suites for the dataset defined in
         the DAG run configuration.
     * get_empty_expect_suite - creates an empty Great Expectation suite using the config defined in the
@@ -14,23 +17,63 @@ This file can be imported as a module and contains the following functions:
         save all outputs from the suite to pre-defined paths in the S3 storage.
     * add_expectations_to_suite - reads existing expectation suite from S3 storage, adds them to an empty expectation
         suite, and saves the populated expectation suite back to S3.
+    * add_expectations_to_suite_local - adds existing expectations that are already in memory to an empty expectation
+        suite, and saves the populated expectation suite back to S3.
 """
-import json
+import atexit
+import io
 import logging
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict
 
+import orjson
 import requests
+import urllib3
 from great_expectations.data_context import BaseDataContext
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+from urllib3.util.retry import Retry
 
 from conn_secrets import get_airflow_auth_conn, get_nrda_conn
 import expectations_config as expect_config
+import paths
 import s3_connector
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(format='%(asctime)s %(module)s %(levelname)s: %(message)s',
                     datefmt='%m/%d/%Y %I:%M:%S %p', level=logging.INFO)
 
+# The token endpoint and the NRDA API are called without verifying their TLS certificates, so urllib3's warning about
+# that is silenced once here rather than raised on every request
+verify_tls = False
+if not verify_tls:
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# (connect, read) timeouts for the API calls, so an unresponsive endpoint fails the task instead of hanging the pod
+request_timeout = (3.05, 30)
+
+# One pooled session for the token and API calls so their connections are reused, retrying transient server errors
+http_session = requests.Session()
+http_adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16,
+                           max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504]))
+http_session.mount("https://", http_adapter)
+http_session.mount("http://", http_adapter)
+# ask both endpoints for JSON. requests already asks for gzip and deflate compression; urllib3's header also offers br
+# when the brotli package is installed, which is the only change to Accept-Encoding
+http_session.headers.update({'Accept': 'application/json',
+                             'Accept-Encoding': make_headers(accept_encoding=True)['accept-encoding']})
+# the keep-alive connections are shut down cleanly when the task's process exits rather than dropped with it
+atexit.register(http_session.close)
+
+# The request headers carrying each access token already granted in this process, with the token's expiry, keyed on
+# token endpoint and client credentials. Repeated API calls reuse one token until shortly before it expires instead of
+# doing a client-credentials grant each time, and a changed secret never gets a token granted for the old one
+token_cache = {}
+# seconds before a token's stated expiry at which it stops being reused, so it can't lapse mid-request
+token_expiry_margin = 30
+
 
 def expectations_init(bucket_name, project_code, ledger_s3, dag_run_id) -> str:
     """Initialise the expectation pipeline, configure existing files.
@@ -52,25 +95,61 @@ def expectations_init(bucket_name, project_code, ledger_s3, dag_run_id) -> str:
     :rtype: str
     """
 
-    s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
-    ledger_obj = s3_client.get_object(Bucket=bucket_name, Key=ledger_s3)
-    ledger = json.loads(ledger_obj["Body"].read())
-    nrda_expect_suite = get_expectations(ledger)
-    exist_expect_suite = {"expectations": nrda_expect_suite}
+    nrda_expect_suite = load_expectations(bucket_name, ledger_s3)
+
+    return save_expectations(bucket_name, project_code, dag_run_id, nrda_expect_suite)
+
+
+def save_expectations(bucket_name, project_code, dag_run_id, expectations) -> str:
+    """Save existing expectations to their path for this run on the S3 storage.
+
+    :param bucket_name: The name of the bucket on S3 where the expectations will be stored.
+    :type bucket_name: str
+    :param project_code: The project code of the dataset that the expectation suite will be run against.
+    :type project_code: str
+    :param dag_run_id: The unique run_id for the particular run of this DAG. Generated by Airflow.
+    :type dag_run_id: str
+    :param expectations: The existing expectations retrieved from the NRDA API.
+    :type expectations: list of dict
+    :return: The path on S3 where the existing expectation file was saved.
+    :rtype: str
+    """
+    s3_client = s3_connector.get_s3_client()
+    exist_expect_suite = {"expectations": expectations}
 
     # Store existing expectations to file on s3 to avoid issue of oversized arg for spark job
-    s3_expect_json_path = "{0}/jobs/{1}/expects.json".format(project_code, dag_run_id)
+    s3_expect_json_path = paths.exist_expects_key(project_code, dag_run_id)
 
     s3_connector.put_item(exist_expect_suite, bucket_name, s3_expect_json_path, s3_client)
 
     return s3_expect_json_path
 
 
+def load_expectations(bucket_name, ledger_s3) -> List[Dict]:
+    """Get the existing expectation suite for the dataset described by the ledger saved on S3.
+
+    This reads the ledger for this run from S3 and passes it to get_expectations(), returning the expectations in memory
+    rather than saving them to S3.
+
+    :param bucket_name: The name of the bucket on S3 where the ledger is stored.
+    :type bucket_name: str
+    :param ledger_s3: The path on S3 to the saved ledger file for this run.
+    :type ledger_s3: str
+    :return: The existing expectation suite for the dataset defined in the ledger.
+    :rtype: list of dict
+    """
+    s3_client = s3_connector.get_s3_client()
+    ledger_obj = s3_client.get_object(Bucket=bucket_name, Key=ledger_s3)
+    ledger = orjson.loads(ledger_obj["Body"].read())
+    return get_expectations(ledger)
+
+
 def get_expectations(ledger) -> List[Dict]:
     """ Get an existing expectation suite for the dataset defined in the DAG run configuration.
 
     This uses the authentication information for the Airflow account to query the NRDAv2 API for the existing
-    expectation suite for the dataset defined as part of the ledger parameter.
+    expectation suite for the dataset defined as part of the ledger parameter. The access token from Keycloak is kept
+    for the rest of the process and reused until just before it expires.
     If there is no existing expectation suite for this dataset then this function, and the whole pipeline, will fail.
 
     :param ledger: The ledger passed to the DAG as part of the run configuration. See nrda_expectation.py for an
@@ -86,11 +165,8 @@ def get_expectations(ledger) -> List[Dict]:
     # client (application) credentials on keycloak
     client_id = airflow_oauth2_conn["login"]
     client_secret = airflow_oauth2_conn["password"]
-    # step A, B - single call with client credentials as the basic auth header - will return access_token
-    data = {'grant_type': 'client_credentials'}
-    access_token_response = requests.post(token_url, data=data, verify=False, allow_redirects=False,
-                                          auth=(client_id, client_secret))
-    tokens = json.loads(access_token_response.text)
+    # use access_token for NRDAv2 API that was retrieved using Airflow account details
+    api_call_headers = _get_auth_headers(token_url, client_id, client_secret)
 
     # the URL for the existing expectation suite for the data asset defined in the DAG run config.
     get_expectation_url = "{0}/api/Expectation/Suite/{1}/{2}/{3}".format(nrda_backend_api_conn["host"],
@@ -98,20 +174,44 @@ def get_expectations(ledger) -> List[Dict]:
                                                                          ledger['classification'])
     logger.info("get expectations backend url: {0}".format(get_expectation_url))
 
-    # use access_token for NRDAv2 API that was retrieved using Airflow account details
-    api_call_headers = {'Authorization': 'Bearer ' + tokens['access_token']}
-    api_call_response = requests.get(get_expectation_url, headers=api_call_headers, verify=False)
+    api_call_response = http_session.get(get_expectation_url, headers=api_call_headers, verify=verify_tls,
+                                         timeout=request_timeout)
     logger.info("response status code: {0}".format(api_call_response.status_code))
     # Cause the pipeline to fail if there is no existing expectation suite for this data asset.
     if api_call_response.status_code == 204:
         raise ValueError("No expectation suite found for that asset name / classification")
-    res = api_call_response.json()
+    api_call_response.raise_for_status()
+    res = orjson.loads(api_call_response.content)
 
     # ONLY return the actual expectations, do not return metadata or storage data for the data asset the existing suite
     # was generated on
     return res['expectations']
 
 
+def _get_auth_headers(token_url, client_id, client_secret) -> dict:
+    # the headers are built once per token and stored with it, so callers must not modify the dict they get back
+    cache_key = (token_url, client_id, client_secret)
+    cached = token_cache.get(cache_key)
+    if cached is not None and time.monotonic() < cached['expires_at']:
+        return cached['headers']
+
+    # step A, B - single call with client credentials as the basic auth header - will return access_token
+    data = {'grant_type': 'client_credentials'}
+    requested_at = time.monotonic()
+    access_token_response = http_session.post(token_url, data=data, verify=verify_tls, allow_redirects=False,
+                                              auth=(client_id, client_secret), timeout=request_timeout)
+    # fail on an error from Keycloak itself, rather than on the missing access_token in its error body
+    access_token_response.raise_for_status()
+    tokens = orjson.loads(access_token_response.content)
+
+    headers = {'Authorization': 'Bearer ' + tokens['access_token']}
+    # a response without an expiry is used once and not cached
+    if 'expires_in' in tokens:
+        token_cache[cache_key] = {'headers': headers,
+                                  'expires_at': requested_at + float(tokens['expires_in']) - token_expiry_margin}
+    return headers
+
+
 def get_empty_expect_suite(bucket_name, dag_run_id, project_code) -> tuple[str, str, str, str]:
     """Generate an empty expectation suite.
 
@@ -131,13 +231,13 @@ def get_empty_expect_suite(bucket_name, dag_run_id, project_code) -> tuple[str,
     :rtype: tuple of str
     """
 
+    expect_suite_s3_loc = paths.empty_suite_key(project_code, dag_run_id)
+    expect_store_s3_loc = paths.expect_store_key(project_code, dag_run_id)
+    expect_validations_s3_loc = paths.validations_key(project_code, dag_run_id)
+    expect_sitebuilder_s3_loc = paths.sitebuilder_key(project_code, dag_run_id)
+
     # retrieve the config from the module
     config = expect_config.get_expect_config(bucket_name, project_code, dag_run_id)
-    expect_suite_s3_loc = "{0}/jobs/{1}/ge_tmp/expectations/{1}.json".format(project_code, dag_run_id)
-    expect_store_s3_loc = "{0}/jobs/{1}/ge_tmp/expectations".format(project_code, dag_run_id)
-    expect_validations_s3_loc = "{0}/jobs/{1}/ge_tmp/uncommitted/validations".format(project_code, dag_run_id)
-    expect_sitebuilder_s3_loc = "{0}/jobs/{1}/ge_tmp/uncommitted/data_docs/local_site".format(project_code, dag_run_id)
-
     # create the Great Expectation context using the retrieved config
     ge_context = BaseDataContext(project_config=config)
     logger.info("CREATED BASE DATA CONTEXT")
@@ -178,23 +278,57 @@ def add_expectations_to_suite(bucket_name, s3_suite_path, existing_expects_s3_pa
     :rtype: bool
     """
 
-    s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
-    # get the empty suite
-    suite_obj = s3_client.get_object(Bucket=bucket_name, Key=s3_suite_path)
-    suite = json.loads(suite_obj['Body'].read())
-    # get the pre-existing expectations
-    expectations_obj = s3_client.get_object(Bucket=bucket_name, Key=existing_expects_s3_path)
-    expectations_full = json.loads(expectations_obj['Body'].read())
-    expectations = expectations_full['expectations']
-    # if the pre-existing expectations file is not empty, then save them to the blank suite generated in a previous step
-    if expectations:
-        suite['expectations'] = expectations
-
-    s3_client.put_object(
-        Body=json.dumps(suite),
-        Bucket=bucket_name,
-        Key=s3_suite_path
-    )
+    s3_client = s3_connector.get_s3_client()
+
+    def get_json(key):
+        # orjson parses the object's bytes as they are, without decoding them to a str first
+        return orjson.loads(s3_connector.get_object_bytes(s3_client, bucket_name, key))
+
+    # get the empty suite and the pre-existing expectations at the same time, as neither depends on the other
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        suite_future = executor.submit(get_json, s3_suite_path)
+        expectations_future = executor.submit(get_json, existing_expects_s3_path)
+        suite = suite_future.result()
+        expectations_full = expectations_future.result()
+
+    return _save_suite(s3_client, bucket_name, s3_suite_path, suite, expectations_full['expectations'])
+
+
+def add_expectations_to_suite_local(bucket_name, s3_suite_path, expectations) -> bool:
+    """ Add existing expectations that are already in memory to the generated empty suite.
+
+    This does the same as add_expectations_to_suite(), but takes the existing expectations directly, e.g. as returned by
+    load_expectations(), rather than reading them back from S3. Use it when the expectations were fetched in the same
+    process, to skip saving them to S3 and downloading them again.
+
+    :param bucket_name: The name of the bucket on S3 where the expectations will be stored. Passed to Airflow as part of
+    the ledger configuration.
+    :type bucket_name: str
+    :param s3_suite_path: Location of the empty Expectation Suite json file generated by get_empty_expect_suite() on S3.
+    :type s3_suite_path: str
+    :param expectations: The existing expectations retrieved from the NRDA API.
+    :type expectations: list of dict
+    :return: True
+    :rtype: bool
+    """
+    s3_client = s3_connector.get_s3_client()
+    suite = orjson.loads(s3_connector.get_object_bytes(s3_client, bucket_name, s3_suite_path))
+
+    return _save_suite(s3_client, bucket_name, s3_suite_path, suite, expectations)
+
+
+def _save_suite(s3_client, bucket_name, s3_suite_path, suite, expectations) -> bool:
+    # the suite on S3 is only rewritten when adding the pre-existing expectations changes it; with none to add, or the
+    # same ones already in place, the upload would just write back the object that was read
+    if not expectations or suite.get('expectations') == expectations:
+        logger.info("Expectation suite at '{0}' is unchanged, skipping upload".format(s3_suite_path))
+        return True
+    suite['expectations'] = expectations
+
+    # a suite with many expectations merged in can get large, so upload it in parallel parts once it passes the
+    # multipart threshold
+    s3_client.upload_fileobj(io.BytesIO(orjson.dumps(suite)), bucket_name, s3_suite_path,
+                             Config=s3_connector.transfer_config)
 
     return True
 
@@ -205,9 +339,16 @@ if __name__ == "__main__":
     ledger_path = sys.argv[3]
     run_id = sys.argv[4]
 
-    exist_expects_s3_path = expectations_init(bucket, project, ledger_path, run_id)
+    # every stage runs in this one process, so the existing expectations are handed straight to the last stage rather
+    # than read back from S3 by add_expectations_to_suite(). They are still saved to the run's folder on S3, as the
+    # separate stages would, but in the background so that nothing waits on the write
+    with ThreadPoolExecutor(max_workers=1) as spill_executor:
+        exist_expects = load_expectations(bucket, ledger_path)
+        spill_future = spill_executor.submit(save_expectations, bucket, project, run_id, exist_expects)
 
-    expect_suite_s3, expect_store_s3, expect_validations_s3, expect_sitebuilder_s3 = \
-        get_empty_expect_suite(bucket, run_id, project)
+        expect_suite_s3, expect_store_s3, expect_validations_s3, expect_sitebuilder_s3 = \
+            get_empty_expect_suite(bucket, run_id, project)
 
-    add_expectations_to_suite(bucket, expect_suite_s3, exist_expects_s3_path)
+        add_expectations_to_suite_local(bucket, expect_suite_s3, exist_expects)
+        # surface any error from the background save before the task reports success
+        spill_future.result()
@@ -0,0 +1,95 @@
+"""Paths on S3 used by the Great Expectations pipeline.
+
+Every file the pipeline writes for a DAG run is stored under "<project_code>/jobs/<dag_run_id>". This module is the one
+place those paths are built, so the stage that writes a file and the stage that reads it back always agree on its key.
+
+This file can be imported as a module and contains the following functions:
+
+    * exist_expects_key - the path of the existing expectations retrieved from the NRDA API.
+    * ge_tmp_prefix - the path under which Great Expectations stores everything for the run.
+    * expect_store_key - the path of the Expectation Store.
+    * empty_suite_key - the path of the Expectation Suite json file, named after the run.
+    * validations_key - the path of the Validation Store.
+    * sitebuilder_key - the path of the Sitebuilder document Store.
+
+"""
+
+
+def exist_expects_key(project_code, dag_run_id) -> str:
+    """Gets the path on S3 where the existing expectations for a run are saved.
+
+    :param project_code: The project code of the dataset that the expectation suite will be run against.
+    :type project_code: int or str
+    :param dag_run_id: The unique run_id for the particular run of this DAG. Generated by Airflow.
+    :type dag_run_id: int or str
+    :return: The path on S3 (excl bucket name) of the existing expectations json file.
+    :rtype: str
+    """
+    return f"{project_code}/jobs/{dag_run_id}/expects.json"
+
+
+def ge_tmp_prefix(project_code, dag_run_id) -> str:
+    """Gets the path on S3 under which the Great Expectations stores for a run are kept.
+
+    :param project_code: The project code of the dataset that the expectation suite will be run against.
+    :type project_code: int or str
+    :param dag_run_id: The unique run_id for the particular run of this DAG. Generated by Airflow.
+    :type dag_run_id: int or str
+    :return: The path on S3 (excl bucket name), without a trailing slash.
+    :rtype: str
+    """
+    return f"{project_code}/jobs/{dag_run_id}/ge_tmp"
+
+
+def expect_store_key(project_code, dag_run_id) -> str:
+    """Gets the path on S3 of the Expectation Store for a run.
+
+    :param project_code: The project code of the dataset that the expectation suite will be run against.
+    :type project_code: int or str
+    :param dag_run_id: The unique run_id for the particular run of this DAG. Generated by Airflow.
+    :type dag_run_id: int or str
+    :return: The path on S3 (excl bucket name), without a trailing slash.
+    :rtype: str
+    """
+    return f"{ge_tmp_prefix(project_code, dag_run_id)}/expectations"
+
+
+def empty_suite_key(project_code, dag_run_id) -> str:
+    """Gets the path on S3 of the Expectation Suite json file for a run.
+
+    The suite is named after the run, so its file sits in the Expectation Store as "<dag_run_id>.json".
+
+    :param project_code: The project code of the dataset that the expectation suite will be run against.
+    :type project_code: int or str
+    :param dag_run_id: The unique run_id for the particular run of this DAG. Generated by Airflow.
+    :type dag_run_id: int or str
+    :return: The path on S3 (excl bucket name) of the Expectation Suite json file.
+    :rtype: str
+    """
+    return f"{expect_store_key(project_code, dag_run_id)}/{dag_run_id}.json"
+
+
+def validations_key(project_code, dag_run_id) -> str:
+    """Gets the path on S3 of the Validation Store for a run.
+
+    :param project_code: The project code of the dataset that the expectation suite will be run against.
+    :type project_code: int or str
+    :param dag_run_id: The unique run_id for the particular run of this DAG. Generated by Airflow.
+    :type dag_run_id: int or str
+    :return: The path on S3 (excl bucket name), without a trailing slash.
+    :rtype: str
+    """
+    return f"{ge_tmp_prefix(project_code, dag_run_id)}/uncommitted/validations"
+
+
+def sitebuilder_key(project_code, dag_run_id) -> str:
+    """Gets the path on S3 of the Sitebuilder document Store for a run.
+
+    :param project_code: The project code of the dataset that the expectation suite will be run against.
+    :type project_code: int or str
+    :param dag_run_id: The unique run_id for the particular run of this DAG. Generated by Airflow.
+    :type dag_run_id: int or str
+    :return: The path on S3 (excl bucket name), without a trailing slash.
+    :rtype: str
+    """
+    return f"{ge_tmp_prefix(project_code, dag_run_id)}/uncommitted/data_docs/local_site"
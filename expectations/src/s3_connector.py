@@ -9,25 +9,41 @@ This file can be imported as a module and contains the following functions:
         application pod as part of the file store.
     * make_s3_client - configures a boto3 client connection using either connection details passed to it, or credentials
         retrieved by get_conn_details if no connection credentials are passed as an argument.
+    * get_s3_client - gets the shared boto3 client for the connection details in the "s3-secret" Kubernetes secret.
     * put_item - places a dict object to given path and bucket on S3 as a serialized JSON file. Creates the bucket if it
         doesn't already exist.
+    * get_object_bytes - reads an object from S3 into memory, fetching large objects with concurrent byte-range GETs.
 
 
 """
-import json
+import functools
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
+import orjson
+from boto3.s3.transfer import TransferConfig
 from botocore.client import Config, BaseClient
 from botocore.exceptions import ParamValidationError, ClientError
 
+# Shared by every client: a connection pool that keeps connections open for reuse across requests, with timeouts so a
+# stalled endpoint fails the task instead of hanging it, and adaptive retries that back off under throttling
+client_config = Config(signature_version='s3v4', max_pool_connections=32, connect_timeout=5, read_timeout=60,
+                       retries={'max_attempts': 10, 'mode': 'adaptive'})
 
+# Transfers of objects over 8MB are split into 8MB parts moved over up to 8 parallel connections; anything smaller is
+# still sent or fetched with a single request
+transfer_config = TransferConfig(multipart_threshold=8 * 1024 * 1024, multipart_chunksize=8 * 1024 * 1024,
+                                 max_concurrency=8)
+
+
+@functools.lru_cache(maxsize=1)
 def get_conn_details() -> dict:
     """Gets S3 connection info from Kubernetes secret "s3-secret".
 
     This gets the s3 connection configuration info from the Kubernetes secret "s3-secret". The secret is mounted to the
     pod as file system objects and is read from there. Each object is transformed to a dictionary string for ease of
-    reuse.
+    reuse. The secret doesn't change for the life of the pod, so it is only read once and the result is cached.
 
     :return: The credential information for the S3 connection that is needed to use Boto3 to connect.
     :rtype: dict
@@ -40,12 +56,13 @@ def get_conn_details() -> dict:
     return s3_conn
 
 
-def make_s3_client(s3_conn=get_conn_details()) -> BaseClient:
+def make_s3_client(s3_conn=None) -> BaseClient:
     """Makes an S3 client object that can be used to interact with the S3 storage.
 
     This makes a boto3 client object that is configured to talk to the defined S3 storage. The parameter of s3_conn is
     OPTIONAL, and if nothing is passed it defaults to the values contained in the Airflow connection with connection id
-    "s3_conn".
+    "s3_conn". Clients are cached per set of connection details, so callers passing the same details share one client
+    and its connection pool.
 
     :param s3_conn: A dict of strings with the keys [access_key, access_secret, endpoint], defaults to the values
         contained in the Kubernetes secret with the name "s3-secret".
@@ -53,21 +70,41 @@ def make_s3_client(s3_conn=get_conn_details()) -> BaseClient:
     :return: The configured Boto3 client object that is ready to connect to the given S3 service.
     :rtype: BaseClient
     """
+    # the default is looked up at call time rather than import time, so the credentials are read once the pod's
+    # environment is in place
+    if s3_conn is None:
+        s3_conn = get_conn_details()
+    return _cached_s3_client(s3_conn["endpoint"], s3_conn["access_key"], s3_conn["access_secret"])
+
+
+@functools.lru_cache(maxsize=4)
+def _cached_s3_client(endpoint, access_key, access_secret) -> BaseClient:
     try:
-        s3_client = boto3.client('s3', aws_access_key_id=s3_conn["access_key"],
-                                 aws_secret_access_key=s3_conn["access_secret"], endpoint_url=s3_conn["endpoint"],
-                                 config=Config(signature_version='s3v4'))
+        s3_client = boto3.client('s3', aws_access_key_id=access_key, aws_secret_access_key=access_secret,
+                                 endpoint_url=endpoint, config=client_config)
     except ValueError as e:
         raise ValueError(e)
 
     return s3_client
 
 
+def get_s3_client() -> BaseClient:
+    """Gets the shared S3 client for the connection details in the Kubernetes secret "s3-secret".
+
+    Building a boto3 client loads the service model and sets up a fresh connection pool, so every caller in the pod
+    shares the one client made from the current get_conn_details().
+
+    :return: The configured Boto3 client object that is ready to connect to the S3 service.
+    :rtype: BaseClient
+    """
+    return make_s3_client()
+
+
 def put_item(object_to_put, bucket_name, target_path, s3_client) -> bool:
     """Writes a given dict object to S3 in json format.
 
     This method writes a given Python dictionary to JSON format and places it in the defined S3 bucket at the chosen
-    S3 path.
+    S3 path. The JSON is serialised with orjson, straight to the bytes that are uploaded.
 
     :param object_to_put: The object to put in S3, encoded as a dictionary
     :type object_to_put: dict
@@ -88,7 +125,7 @@ def put_item(object_to_put, bucket_name, target_path, s3_client) -> bool:
             raise ClientError(e)
     try:
         s3_client.put_object(
-            Body=json.dumps(object_to_put),
+            Body=orjson.dumps(object_to_put),
             Bucket=bucket_name,
             Key=target_path
         )
@@ -97,3 +134,53 @@ def put_item(object_to_put, bucket_name, target_path, s3_client) -> bool:
         raise ParamValidationError()
     except ClientError as e:
         raise ClientError(e)
+
+
+def get_object_bytes(s3_client, bucket_name, key, part_size=8 * 1024 * 1024, concurrency=8):
+    """Reads an object from S3 into memory, fetching large objects with concurrent byte-range GETs.
+
+    The first part_size bytes are fetched with a single ranged GET, whose Content-Range also gives the size of the whole
+    object. Objects that fit in that first part, which is most of them, cost exactly one request. The rest of a larger
+    object is split into part_size ranges that are fetched in parallel on a thread pool, each pinned to the ETag of the
+    first response so the object can't change part way through.
+
+    :param s3_client: The pre-configured s3_client.
+    :type s3_client: BaseClient
+    :param bucket_name: The name of the bucket the object is stored in.
+    :type bucket_name: str
+    :param key: The path on S3 (excl bucket name) of the object to read.
+    :type key: str
+    :param part_size: The size in bytes of each ranged GET, defaults to 8MB.
+    :type part_size: int
+    :param concurrency: The maximum number of ranged GETs in flight at once, defaults to 8.
+    :type concurrency: int
+    :return: The contents of the object.
+    :rtype: bytes or bytearray
+    """
+    try:
+        first = s3_client.get_object(Bucket=bucket_name, Key=key, Range="bytes=0-{0}".format(part_size - 1))
+    except ClientError as e:
+        # an empty object has no byte 0 to start the range from
+        if e.response["Error"]["Code"] != "InvalidRange":
+            raise
+        return s3_client.get_object(Bucket=bucket_name, Key=key)["Body"].read()
+    head = first["Body"].read()
+    # Content-Range has the form "bytes start-end/size"
+    size = int(first["ContentRange"].rsplit("/", 1)[1]) if "ContentRange" in first else len(head)
+    if size <= len(head):
+        return head
+
+    buf = bytearray(size)
+    buf[:len(head)] = head
+
+    def fetch_range(start):
+        end = min(start + part_size, size) - 1
+        part = s3_client.get_object(Bucket=bucket_name, Key=key, Range="bytes={0}-{1}".format(start, end),
+                                    IfMatch=first["ETag"])
+        buf[start:end + 1] = part["Body"].read()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # consume the results so that any error raised in a worker is re-raised here
+        list(executor.map(fetch_range, range(len(head), size, part_size)))
+
+    return buf
@@ -5,10 +5,35 @@ import logging
 import warnings
 from unittest import TestCase, mock, main
 
+from botocore.exceptions import ClientError
+
 from expectations.src import init_expects, s3_connector
 from . import super_env
 
 
+def setUpModule():
+    logging.disable(logging.CRITICAL)
+    warnings.filterwarnings(action="ignore", message="unclosed", category=ResourceWarning)
+
+
+def tearDownModule():
+    logging.disable(logging.NOTSET)
+
+
+def _wait_for_key(s3_client, bucket, key, timeout=5.0):
+    # poll until the key can be read rather than sleeping for a fixed time; returns False if it never shows up so the
+    # test itself reports what is missing
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            s3_client.head_object(Bucket=bucket, Key=key)
+            return True
+        except ClientError:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.1)
+
+
 class Test(TestCase):
     bucket_name = "testbucket"
     project_code = "test_code"
@@ -25,30 +50,45 @@ class Test(TestCase):
     }, dataset_id="pedw", label="spell", classification="demo", version="121", group_count="gcount", location="s3",
         location_details="s3a://sail0000v/pedw_spell.csv")
     ledger_s3_path = "ledger/path/ledge.json"
+    empty_suite = {"expectation_suite_name": dag_run_id, "expectations": [], "meta": {}}
+    existing_expects = {"expectations": [
+        {"expectation_type": "expect_table_columns_to_match_ordered_list",
+         "kwargs": {"column_list": ["spell_id", "start_date"]}, "meta": {}}
+    ]}
 
     @classmethod
     def setUpClass(cls, s3_ledger=s3_ledger, bucket_name=bucket_name, ledger_s3_path=ledger_s3_path):
         env_vars = super_env.get_s3_env() | super_env.get_nrda_env() | super_env.get_airflow_env()
         cls.env_patcher = mock.patch.dict(os.environ, env_vars)
         cls.env_patcher.start()
+        # init_expects reads its connection details through its own imports, so clear those caches as well as the one
+        # used by the fixtures here
+        for cached in (s3_connector.get_conn_details, init_expects.s3_connector.get_conn_details,
+                       init_expects.get_airflow_auth_conn, init_expects.get_nrda_conn):
+            cached.cache_clear()
         s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
         s3_connector.put_item(s3_ledger, bucket_name, ledger_s3_path, s3_client)
-        logging.disable(logging.CRITICAL)
-        warnings.filterwarnings(action="ignore", message="unclosed", category=ResourceWarning)
         super().setUpClass()
 
     @classmethod
     def tearDownClass(cls, bucket_name=bucket_name, project_code=project_code, dag_run_id=dag_run_id):
         super().tearDownClass()
         s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
-        all_objs = s3_client.list_objects_v2(Bucket=bucket_name)
-        if 'Contents' in all_objs:
-            for item in all_objs['Contents']:
-                s3_client.delete_object(Bucket=bucket_name, Key=item['Key'])
+        # a listing page holds at most 1000 keys, the most a single delete_objects call accepts, so each page is
+        # deleted in one request
+        for page in s3_client.get_paginator('list_objects_v2').paginate(Bucket=bucket_name):
+            if 'Contents' in page:
+                s3_client.delete_objects(Bucket=bucket_name, Delete={
+                    "Objects": [{"Key": item['Key']} for item in page['Contents']],
+                    "Quiet": True
+                })
         s3_client.delete_bucket(
             Bucket=bucket_name
         )
         cls.env_patcher.stop()
+        for cached in (s3_connector.get_conn_details, init_expects.s3_connector.get_conn_details,
+                       init_expects.get_airflow_auth_conn, init_expects.get_nrda_conn):
+            cached.cache_clear()
 
     def test_get_expectations(self, ledger=s3_ledger):
         self.assertIsInstance(init_expects.get_expectations(ledger), list)
@@ -87,11 +127,17 @@ class Test(TestCase):
         self.assertEqual(expect_validations_form, expect_validations_s3_loc)
         self.assertEqual(expect_sitebuilder_form, expect_sitebuilder_s3_loc)
 
-    def test_add_exp_to_suite(self, bucket=bucket_name, dag_run_id=dag_run_id, project_code=project_code):
-        time.sleep(15)
+    def test_add_exp_to_suite(self, bucket=bucket_name, dag_run_id=dag_run_id, project_code=project_code,
+                              empty_suite=empty_suite, existing_expects=existing_expects):
         expect_suite_form = "{0}/jobs/{1}/ge_tmp/expectations/{1}.json".format(project_code, dag_run_id)
         s3_expect_json_path = "{0}/jobs/{1}/expects.json".format(project_code, dag_run_id)
         s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
+        # put the empty suite and the existing expectations here, so the test doesn't rely on the tests that create
+        # them running first
+        s3_connector.put_item(empty_suite, bucket, expect_suite_form, s3_client)
+        s3_connector.put_item(existing_expects, bucket, s3_expect_json_path, s3_client)
+        for key in (expect_suite_form, s3_expect_json_path):
+            self.assertTrue(_wait_for_key(s3_client, bucket, key), key)
 
         self.assertTrue(init_expects.add_expectations_to_suite(bucket, expect_suite_form, s3_expect_json_path))
 
@@ -101,6 +147,50 @@ class Test(TestCase):
         self.assertEqual(result['expectation_suite_name'], dag_run_id)
         self.assertEqual(result['expectations'], eesuite['expectations'])
 
+    def test_save_expectations(self, bucket=bucket_name, project_code=project_code, dag_run_id=dag_run_id,
+                               existing_expects=existing_expects):
+        s3_expect_json_path = "{0}/jobs/{1}-save/expects.json".format(project_code, dag_run_id)
+        s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
+
+        result = init_expects.save_expectations(bucket, project_code, dag_run_id + "-save",
+                                                existing_expects['expectations'])
+        self.assertEqual(result, s3_expect_json_path)
+
+        saved = json.loads(s3_client.get_object(Bucket=bucket, Key=result)["Body"].read())
+        self.assertEqual(saved, {"expectations": existing_expects['expectations']})
+
+    def test_load_expectations(self, bucket=bucket_name, ledger_s3_path=ledger_s3_path):
+        s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
+        keys_before = [item['Key'] for item in s3_client.list_objects_v2(Bucket=bucket).get('Contents', [])]
+
+        result = init_expects.load_expectations(bucket, ledger_s3_path)
+        self.assertIsInstance(result, list)
+        self.assertIsInstance(result[0], dict)
+        self.assertEqual(result[0]['expectation_type'], 'expect_table_columns_to_match_ordered_list')
+
+        # the expectations are only returned, nothing is written to the bucket
+        keys_after = [item['Key'] for item in s3_client.list_objects_v2(Bucket=bucket).get('Contents', [])]
+        self.assertEqual(keys_after, keys_before)
+
+    def test_add_exp_to_suite_local(self, bucket=bucket_name, dag_run_id=dag_run_id, project_code=project_code,
+                                    empty_suite=empty_suite, existing_expects=existing_expects):
+        expect_suite_form = "{0}/jobs/{1}-local/ge_tmp/expectations/{1}.json".format(project_code, dag_run_id)
+        s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
+        s3_connector.put_item(empty_suite, bucket, expect_suite_form, s3_client)
+        self.assertTrue(_wait_for_key(s3_client, bucket, expect_suite_form), expect_suite_form)
+
+        self.assertTrue(init_expects.add_expectations_to_suite_local(bucket, expect_suite_form,
+                                                                     existing_expects['expectations']))
+
+        result = json.loads(s3_client.get_object(Bucket=bucket, Key=expect_suite_form)["Body"].read())
+        self.assertEqual(result['expectation_suite_name'], dag_run_id)
+        self.assertEqual(result['expectations'], existing_expects['expectations'])
+
+        # with no expectations to add the suite on S3 is left as it was, rather than emptied
+        self.assertTrue(init_expects.add_expectations_to_suite_local(bucket, expect_suite_form, []))
+        unchanged = json.loads(s3_client.get_object(Bucket=bucket, Key=expect_suite_form)["Body"].read())
+        self.assertEqual(unchanged, result)
+
 
 if __name__ == "__main__":
     main()
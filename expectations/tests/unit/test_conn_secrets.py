@@ -17,6 +17,11 @@ class Test(TestCase):
         super().tearDownClass()
         cls.env_patcher.stop()
 
+    def setUp(self):
+        # the getters are cached, so clear them for each test to read the environment that test patched in
+        conn_secrets.get_nrda_conn.cache_clear()
+        conn_secrets.get_airflow_auth_conn.cache_clear()
+
     def test_get_nrda_conn(self):
         env_var = super_env.get_nrda_env()
         result = conn_secrets.get_nrda_conn()
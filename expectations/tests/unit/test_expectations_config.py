@@ -15,8 +15,17 @@ class Test(TestCase):
         env_vars = super_env.get_s3_env()
         cls.env_patcher = mock.patch.dict(os.environ, env_vars)
         cls.env_patcher.start()
+        # get_expect_config reads the connection details through its own import of s3_connector, whose cache may
+        # already hold values read before the test environment was patched in
+        expect_config.s3_connector.get_conn_details.cache_clear()
         super().setUpClass()
 
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.env_patcher.stop()
+        expect_config.s3_connector.get_conn_details.cache_clear()
+
     def test_get_expect_config(self, bucket_name=bucket_name, project_code=project_code, dag_run_id=dag_run_id):
         """
         Test that it returns an object of type DataContextConfig
@@ -0,0 +1,71 @@
+import json
+from unittest import TestCase, mock, main
+
+from expectations.src import init_expects
+
+
+def _token_response(**tokens):
+    response = mock.MagicMock()
+    response.content = json.dumps(dict(access_token="tok", **tokens)).encode()
+    return response
+
+
+class Test(TestCase):
+    token_url = "http://keycloak/token"
+    client_id = "airflow"
+    client_secret = "secret"
+
+    def setUp(self):
+        # the cache lives for the whole process, so start each test without any token granted by another
+        init_expects.token_cache.clear()
+        self.addCleanup(init_expects.token_cache.clear)
+
+    @mock.patch.object(init_expects.time, "monotonic")
+    @mock.patch.object(init_expects.http_session, "post")
+    def test_get_auth_headers_reused_until_margin(self, post, monotonic, token_url=token_url, client_id=client_id,
+                                                  client_secret=client_secret):
+        post.return_value = _token_response(expires_in=300)
+        monotonic.return_value = 1000.0
+        self.assertEqual(init_expects._get_auth_headers(token_url, client_id, client_secret),
+                         {'Authorization': 'Bearer tok'})
+
+        # still inside the expiry less the margin, so the cached token is reused
+        monotonic.return_value = 1000.0 + 300 - init_expects.token_expiry_margin - 1
+        init_expects._get_auth_headers(token_url, client_id, client_secret)
+        self.assertEqual(post.call_count, 1)
+
+        # within the margin of the expiry, so a new token is requested
+        monotonic.return_value = 1000.0 + 300 - init_expects.token_expiry_margin
+        init_expects._get_auth_headers(token_url, client_id, client_secret)
+        self.assertEqual(post.call_count, 2)
+
+    @mock.patch.object(init_expects.http_session, "post")
+    def test_get_auth_headers_expiry_below_margin(self, post, token_url=token_url, client_id=client_id,
+                                                  client_secret=client_secret):
+        post.return_value = _token_response(expires_in=init_expects.token_expiry_margin - 10)
+        init_expects._get_auth_headers(token_url, client_id, client_secret)
+        init_expects._get_auth_headers(token_url, client_id, client_secret)
+        self.assertEqual(post.call_count, 2)
+
+    @mock.patch.object(init_expects.http_session, "post")
+    def test_get_auth_headers_no_expiry(self, post, token_url=token_url, client_id=client_id,
+                                        client_secret=client_secret):
+        post.return_value = _token_response()
+        self.assertEqual(init_expects._get_auth_headers(token_url, client_id, client_secret),
+                         {'Authorization': 'Bearer tok'})
+        init_expects._get_auth_headers(token_url, client_id, client_secret)
+        self.assertEqual(post.call_count, 2)
+        self.assertEqual(init_expects.token_cache, {})
+
+    @mock.patch.object(init_expects.http_session, "post")
+    def test_get_auth_headers_new_secret(self, post, token_url=token_url, client_id=client_id,
+                                         client_secret=client_secret):
+        post.return_value = _token_response(expires_in=300)
+        init_expects._get_auth_headers(token_url, client_id, client_secret)
+        init_expects._get_auth_headers(token_url, client_id, "rotated")
+        self.assertEqual(post.call_count, 2)
+        self.assertEqual(post.call_args.kwargs["auth"], (client_id, "rotated"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+from unittest import TestCase, main
+from expectations.src import paths
+
+
+class Test(TestCase):
+    project_code = "test_code"
+    dag_run_id = "test0-10-11-2021"
+
+    def test_exist_expects_key(self, project_code=project_code, dag_run_id=dag_run_id):
+        self.assertEqual(paths.exist_expects_key(project_code, dag_run_id),
+                         "test_code/jobs/test0-10-11-2021/expects.json")
+
+    def test_empty_suite_key(self, project_code=project_code, dag_run_id=dag_run_id):
+        self.assertEqual(paths.empty_suite_key(project_code, dag_run_id),
+                         "test_code/jobs/test0-10-11-2021/ge_tmp/expectations/test0-10-11-2021.json")
+
+    def test_store_keys(self, project_code=project_code, dag_run_id=dag_run_id):
+        self.assertEqual(paths.expect_store_key(project_code, dag_run_id),
+                         "test_code/jobs/test0-10-11-2021/ge_tmp/expectations")
+        self.assertEqual(paths.validations_key(project_code, dag_run_id),
+                         "test_code/jobs/test0-10-11-2021/ge_tmp/uncommitted/validations")
+        self.assertEqual(paths.sitebuilder_key(project_code, dag_run_id),
+                         "test_code/jobs/test0-10-11-2021/ge_tmp/uncommitted/data_docs/local_site")
+
+    def test_int_project_code(self):
+        self.assertEqual(paths.exist_expects_key(1234, "run"), "1234/jobs/run/expects.json")
+
+
+if __name__ == "__main__":
+    main()
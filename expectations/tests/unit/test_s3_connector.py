@@ -9,6 +9,15 @@ from expectations.src import s3_connector
 from . import super_env
 
 
+def setUpModule():
+    logging.disable(logging.CRITICAL)
+    warnings.filterwarnings(action="ignore", message="unclosed", category=ResourceWarning)
+
+
+def tearDownModule():
+    logging.disable(logging.NOTSET)
+
+
 class Test(TestCase):
     new_bucket = "notabucket"
     existing_bucket = "sail0000v"
@@ -19,8 +28,8 @@ class Test(TestCase):
         env_vars = super_env.get_s3_env()
         cls.env_patcher = mock.patch.dict(os.environ, env_vars)
         cls.env_patcher.start()
-        logging.disable(logging.CRITICAL)
-        warnings.filterwarnings(action="ignore", message="unclosed", category=ResourceWarning)
+        # drop any connection details cached before the test environment was patched in
+        s3_connector.get_conn_details.cache_clear()
         super().setUpClass()
 
     @classmethod
@@ -40,6 +49,7 @@ class Test(TestCase):
             Key=target_path
         )
         cls.env_patcher.stop()
+        s3_connector.get_conn_details.cache_clear()
 
     def test_get_conn_details(self):
         env_vars = super_env.get_s3_env()
@@ -61,6 +71,12 @@ class Test(TestCase):
         result = s3_connector.make_s3_client()
         self.assertIsInstance(result, BaseClient)
 
+    def test_get_s3_client(self):
+        result = s3_connector.get_s3_client()
+        self.assertIsInstance(result, BaseClient)
+        # the same connection details give back the same cached client
+        self.assertIs(s3_connector.get_s3_client(), result)
+
     def test_put_item_existing_bucket(self, bucket_name=existing_bucket, target_path=target_path):
         object_to_put = {"stuff": "nonsense"}
         s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
@@ -71,6 +87,23 @@ class Test(TestCase):
         s3_client = s3_connector.make_s3_client(s3_connector.get_conn_details())
         self.assertTrue(s3_connector.put_item(object_to_put, bucket_name, target_path, s3_client))
 
+    def test_get_object_bytes(self, bucket_name=existing_bucket):
+        s3_client = s3_connector.get_s3_client()
+        key = "not/a/path/bytes"
+        body = bytes(range(256)) * 4
+        s3_client.put_object(Body=body, Bucket=bucket_name, Key=key)
+        # a small part size makes the object come back as several concurrent ranges
+        self.assertEqual(bytes(s3_connector.get_object_bytes(s3_client, bucket_name, key, part_size=100)), body)
+        self.assertEqual(s3_connector.get_object_bytes(s3_client, bucket_name, key), body)
+        s3_client.delete_object(Bucket=bucket_name, Key=key)
+
+    def test_get_object_bytes_empty(self, bucket_name=existing_bucket):
+        s3_client = s3_connector.get_s3_client()
+        key = "not/a/path/empty"
+        s3_client.put_object(Body=b"", Bucket=bucket_name, Key=key)
+        self.assertEqual(s3_connector.get_object_bytes(s3_client, bucket_name, key), b"")
+        s3_client.delete_object(Bucket=bucket_name, Key=key)
+
 
 if __name__ == "__main__":
     main()